@@ -7,7 +7,7 @@
 -- 2. Handles raw inline elements (`RawInline`) potentially containing `\HighlightPlaceholder`,
 --    converting them into Span elements with the 'highlight' class.
 -- 3. Handles Div elements by walking their content to ensure inline handlers are applied.
--- NOTE: This filter *does not* handle code block placeholders (@@CODEBLOCK_ID_n@@)
+-- NOTE: This filter *does not* handle code block placeholders (@@CODEBLOCK_ID_<hash>@@)
 --       or admonition markers (@@ADMONITION_START/END@@). They are intended
 --       to pass through Pandoc unchanged (likely as Str in Para) for post-processing.
 --
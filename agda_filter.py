@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# agda_filter.py
+# Purpose: Python alternative to agda-filter.lua that works on Pandoc's JSON AST (-t json)
+#          and visits every element of a document exactly once.
+# Actions, all in the same traversal:
+# 1. Code elements containing @@AgdaTerm@@ markers become Code elements with the Agda class
+#    as CSS class (as Code in agda-filter.lua).
+# 2. RawInline LaTeX \HighlightPlaceholder{...} becomes a Span with the 'highlight' class
+#    (as RawInline in agda-filter.lua).
+# 3. Code block placeholders (@@CODEBLOCK_ID_<hash>@@) directly in paragraphs are replaced with
+#    the formatted code blocks (postprocess.format_code_block) as raw Markdown blocks. A
+#    placeholder nested in another inline (Emph, Strong, Span, Link...) cannot become a block
+#    there and is left as text, for the placeholder pass of postprocess.py.
+# agda-filter.lua additionally walks the content of every Div again, so an inline nested in
+# n Divs is visited n+1 times there. Admonition markers are still left to
+# postprocess.process_conway_admonitions, since the indentation they need spans several blocks.
+#
+# USAGE:
+#   python convert_tree.py src/Ledger preprocess_macros.json --filter-engine python
+#   or as a Pandoc JSON filter (the code blocks are read from $AGDA_CODE_BLOCKS; if unset, the
+#   placeholders are left for postprocess.py):
+#   AGDA_CODE_BLOCKS=code_blocks.json pandoc Transaction.lagda.temp -f latex -t gfm+attributes --filter ./agda_filter.py -o Transaction.md.intermediate
+
+import json
+import os
+import re
+import sys
+
+from postprocess import code_placeholder_pattern, format_code_block
+
+agda_term_pattern = re.compile(r'^\s*@@AgdaTerm@@(.*?)@@\s*$', re.DOTALL)
+marker_argument_pattern = re.compile(r'([^=@]+)=([^@]+)')
+highlight_pattern = re.compile(r'\\HighlightPlaceholder\{(.*)\}', re.DOTALL)
+# Inlines dropped at the edges of the paragraphs a code block placeholder splits
+whitespace_inlines = {"Space", "SoftBreak", "LineBreak"}
+
+def filter_code(element):
+    """
+    Turns a Code element holding an @@AgdaTerm@@basename=...@@class=...@@ marker into a
+    Code element with the basename as text and the lowercased class as CSS class.
+    Returns:
+        dict: The new element, or None to keep the element unchanged.
+    """
+    marker_match = agda_term_pattern.match(element["c"][1])
+    if not marker_match:
+        return None
+    payload = marker_match.group(1)
+    args = {key.strip(): value.strip() for key, value in marker_argument_pattern.findall(payload)}
+    if not args.get("basename") or not args.get("class"):
+        print(f"Warning: Could not parse AgdaTerm marker payload: {payload}", file=sys.stderr)
+        return None
+    return {"t": "Code", "c": [["", [args["class"].lower()], []], args["basename"]]}
+
+def filter_raw_inline(element):
+    """
+    Turns a LaTeX RawInline \\HighlightPlaceholder{...} into a Span with the 'highlight' class.
+    Returns:
+        dict: The new element, or None to keep the element unchanged.
+    """
+    raw_format, text = element["c"]
+    if "latex" not in raw_format:
+        return None
+    highlight_match = highlight_pattern.search(text)
+    if not highlight_match:
+        return None
+    return {"t": "Span", "c": [["", ["highlight"], []], [{"t": "Str", "c": highlight_match.group(1)}]]}
+
+def split_paragraph(block, code_blocks):
+    """
+    Splits a Para or Plain block at the code block placeholders in its text: the text around
+    each placeholder stays in blocks of the same kind and the placeholder itself becomes a raw
+    Markdown block holding the formatted code block.
+    Returns:
+        list[dict]: The blocks replacing the paragraph, or None to keep it unchanged.
+    """
+    inlines = block["c"]
+    if not any(inline["t"] == "Str" and "@@CODEBLOCK_ID_" in inline["c"] for inline in inlines):
+        return None
+    blocks = []
+    current = []
+
+    def flush():
+        start, end = 0, len(current)
+        while start < end and current[start]["t"] in whitespace_inlines:
+            start += 1
+        while end > start and current[end - 1]["t"] in whitespace_inlines:
+            end -= 1
+        if start < end:
+            blocks.append({"t": block["t"], "c": current[start:end]})
+        current.clear()
+
+    for inline in inlines:
+        if inline["t"] != "Str":
+            current.append(inline)
+            continue
+        text = inline["c"]
+        pos = 0
+        for match in code_placeholder_pattern.finditer(text):
+            replacement = format_code_block(match.group(0), code_blocks)
+            if replacement == match.group(0):
+                continue # Unknown block: keep the placeholder as text
+            if match.start() > pos:
+                current.append({"t": "Str", "c": text[pos:match.start()]})
+            flush()
+            blocks.append({"t": "RawBlock", "c": ["markdown", replacement.strip('\n')]})
+            pos = match.end()
+        if pos < len(text):
+            current.append(inline if pos == 0 else {"t": "Str", "c": text[pos:]})
+    flush()
+    return blocks
+
+def walk(items, code_blocks=None):
+    """
+    Filters a list from the AST in place, children before their parents (as Pandoc does).
+    With code_blocks None, paragraphs are not split and the placeholders stay as text.
+    Elements are dicts with a "t" key; any other list is searched for elements too.
+    Elements created by the filter are not visited again.
+    Returns:
+        int: The number of elements visited.
+    """
+    visited = 0
+    i = 0
+    while i < len(items):
+        item = items[i]
+        if isinstance(item, list):
+            visited += walk(item, code_blocks)
+        elif isinstance(item, dict) and "t" in item:
+            visited += 1
+            contents = item.get("c")
+            if isinstance(contents, list):
+                visited += walk(contents, code_blocks)
+            kind = item["t"]
+            if kind == "Code":
+                replacement = filter_code(item)
+            elif kind == "RawInline":
+                replacement = filter_raw_inline(item)
+            elif kind in ("Para", "Plain") and code_blocks is not None:
+                new_blocks = split_paragraph(item, code_blocks)
+                if new_blocks is not None:
+                    items[i:i + 1] = new_blocks
+                    i += len(new_blocks)
+                    continue
+                replacement = None
+            else:
+                replacement = None
+            if replacement is not None:
+                items[i] = replacement
+        i += 1
+    return visited
+
+def filter_document(document, code_blocks=None):
+    """
+    Applies the filter to a document in Pandoc's JSON format, in place, in a single traversal.
+    Args:
+        document (dict): The parsed output of pandoc -t json.
+        code_blocks (dict): The code block data stored by preprocess.py; None leaves the
+            code block placeholders to postprocess_markdown (as agda-filter.lua does).
+    Returns:
+        int: The number of elements visited (each element is visited once).
+    """
+    return walk(document["blocks"], code_blocks)
+
+# --- Script Entry Point (Pandoc JSON filter) ---
+if __name__ == "__main__":
+    code_blocks = None
+    code_blocks_file = os.environ.get("AGDA_CODE_BLOCKS")
+    if code_blocks_file:
+        with open(code_blocks_file, 'r', encoding='utf-8') as f_code:
+            code_blocks = json.load(f_code)
+    document = json.load(sys.stdin)
+    filter_document(document, code_blocks)
+    json.dump(document, sys.stdout)
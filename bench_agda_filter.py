@@ -0,0 +1,80 @@
+# bench_agda_filter.py
+# Purpose: Compares agda-filter.lua with agda_filter.py on documents whose paragraphs are
+#          nested ever more deeply in Divs (unknown LaTeX environments become Divs).
+# For each nesting depth it reports:
+#   lua calls   - Code/RawInline handler calls made by agda-filter.lua: Pandoc's own traversal
+#                 plus one more walk for each enclosing Div
+#   py visits   - elements visited by agda_filter.py (every element exactly once)
+#   lua, python - time of the Pandoc run with the Lua filter, and of the JSON round trip
+#                 (pandoc -t json, agda_filter.py, pandoc -f json) with the Python filter
+# Requires pandoc on the PATH.
+#
+# USAGE:
+#   python bench_agda_filter.py              (200 paragraphs per document)
+#   python bench_agda_filter.py 1000
+
+import json
+import shutil
+import sys
+import time
+
+import agda_filter
+from pipeline import call_pandoc, lua_filter_file, pandoc_args
+
+nesting_depths = [1, 8, 32]
+
+def make_document(paragraphs, depth):
+    """
+    Returns preprocessed LaTeX with the given number of paragraphs, each holding Agda term
+    markers and a highlight placeholder, all nested in depth environments.
+    """
+    body = []
+    for i in range(paragraphs):
+        body.append(f"The field \\texttt{{@@AgdaTerm@@basename=txins@@class=AgdaField@@}} of input {i} "
+                    f"and \\HighlightPlaceholder{{new {i}}} with \\texttt{{@@AgdaTerm@@basename=Coin@@class=AgdaFunction@@}}.\n")
+    opening = ''.join(f"\\begin{{nest{level}}}\n" for level in range(depth))
+    closing = ''.join(f"\\end{{nest{level}}}\n" for level in reversed(range(depth)))
+    return opening + '\n'.join(body) + closing
+
+def count_lua_calls(items, divs=0):
+    """
+    Counts the Code/RawInline handler calls of agda-filter.lua: each such inline is seen by
+    Pandoc's traversal and again by the walk_block of every enclosing Div.
+    """
+    calls = 0
+    for item in items:
+        if isinstance(item, list):
+            calls += count_lua_calls(item, divs)
+        elif isinstance(item, dict) and "t" in item:
+            if item["t"] in ("Code", "RawInline"):
+                calls += 1 + divs
+            if isinstance(item.get("c"), list):
+                calls += count_lua_calls(item["c"], divs + (item["t"] == "Div"))
+    return calls
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def convert_with_python_filter(latex):
+    document = json.loads(call_pandoc([*pandoc_args[:2], "-t", "json"], latex))
+    visited = agda_filter.filter_document(document)
+    return call_pandoc(["-f", "json", *pandoc_args[2:]], json.dumps(document)), visited
+
+if __name__ == "__main__":
+    if shutil.which("pandoc") is None:
+        print("Error: pandoc not found on the PATH", file=sys.stderr)
+        sys.exit(1)
+    paragraphs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print(f"{paragraphs} paragraphs per document")
+    print(f"{'depth':>6} {'lua calls':>10} {'py visits':>10} {'lua':>8} {'python':>8}")
+    for depth in nesting_depths:
+        latex = make_document(paragraphs, depth)
+        lua_calls = count_lua_calls(json.loads(call_pandoc([*pandoc_args[:2], "-t", "json"], latex))["blocks"])
+        lua_output, lua_time = timed(call_pandoc, [*pandoc_args, "--lua-filter", lua_filter_file], latex)
+        (python_output, visited), python_time = timed(convert_with_python_filter, latex)
+        if lua_output != python_output:
+            print(f"Error: the filters disagree at depth {depth}", file=sys.stderr)
+            sys.exit(1)
+        print(f"{depth:>6} {lua_calls:>10} {visited:>10} {lua_time:>7.3f}s {python_time:>7.3f}s")
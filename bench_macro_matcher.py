@@ -0,0 +1,89 @@
+# bench_macro_matcher.py
+# Purpose: Shows how Agda term macro matching scales with the size of the macro table.
+# Compares, for tables of 100 to 10,000 macros:
+#   regex - the former approach: one \\(A|B|C|...)\{\} alternation, compiled for every file
+#   trie  - macro_matcher.MacroTrie, built once and reused (lookup at each backslash)
+# Both match the same synthetic document with a fixed number of macro references, so
+# any growth in the match time comes from the table size alone.
+#
+# USAGE:
+#   python bench_macro_matcher.py              (20000 references per document)
+#   python bench_macro_matcher.py 100000
+
+import random
+import re
+import string
+import sys
+import time
+
+from macro_matcher import MacroTrie
+
+table_sizes = [100, 1000, 10000]
+
+def make_macro_names(count, rng):
+    """
+    Returns count distinct macro-like names (letters only, 3-16 characters).
+    """
+    names = set()
+    while len(names) < count:
+        names.add(''.join(rng.choice(string.ascii_letters) for _ in range(rng.randint(3, 16))))
+    return sorted(names)
+
+def make_document(names, references, rng):
+    """
+    Returns LaTeX-like prose with the given number of control sequences, 3 out of 4 of
+    which are known macros followed by {} (the rest are unknown, e.g. \\item).
+    """
+    words = ["the", "transaction", "body", "of", "a", "set", "and", "value"]
+    parts = []
+    for _ in range(references):
+        parts.append(' '.join(rng.choice(words) for _ in range(6)))
+        if rng.random() < 0.75:
+            parts.append(f" \\{rng.choice(names)}{{}} ")
+        else:
+            parts.append(" \\emph{x} ")
+    return ''.join(parts)
+
+def compile_regex(names):
+    return re.compile(r'\\(' + '|'.join(re.escape(k) for k in names) + r')\{\}')
+
+def match_with_regex(pattern, document):
+    return sum(1 for _ in pattern.finditer(document))
+
+def build_trie(names):
+    trie = MacroTrie()
+    for name in names:
+        trie.add(name, name)
+    return trie
+
+def match_with_trie(trie, document):
+    count = 0
+    pos = document.find('\\')
+    while pos >= 0:
+        found = trie.longest_match(document, pos + 1)
+        if found and document.startswith('{}', found[0]):
+            count += 1
+        pos = document.find('\\', pos + 1)
+    return count
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+if __name__ == "__main__":
+    references = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rng = random.Random(42)
+    print(f"{references} control sequences per document")
+    print(f"{'macros':>8} {'regex compile':>14} {'regex match':>12} {'trie build':>11} {'trie match':>11}")
+    for size in table_sizes:
+        names = make_macro_names(size, rng)
+        document = make_document(names, references, rng)
+        pattern, compile_time = timed(compile_regex, names)
+        regex_count, regex_time = timed(match_with_regex, pattern, document)
+        trie, build_time = timed(build_trie, names)
+        trie_count, match_time = timed(match_with_trie, trie, document)
+        if regex_count != trie_count:
+            print(f"Error: regex found {regex_count} macros, trie found {trie_count}", file=sys.stderr)
+            sys.exit(1)
+        print(f"{size:>8} {compile_time:>13.3f}s {regex_time:>11.3f}s {build_time:>10.3f}s {match_time:>10.3f}s")
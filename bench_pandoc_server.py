@@ -0,0 +1,69 @@
+# bench_pandoc_server.py
+# Purpose: Compares starting Pandoc for every file with converting through a long-lived
+#          Pandoc server (pandoc_server.py) on a tree of small modules, where Pandoc's
+#          startup time weighs most.
+# The modules are synthetic (synthetic_lagda.py). Each one is converted with pipeline.convert
+# in two modes, and their outputs are checked to be identical:
+#   spawn   - pandoc + agda-filter.lua as a subprocess per file
+#   server  - LaTeX to JSON AST, agda_filter.py, JSON AST to Markdown, with both conversions
+#             as requests to one pandoc server
+# Requires a pandoc with `pandoc server` (or pandoc-server) on the PATH.
+#
+# USAGE:
+#   python bench_pandoc_server.py              (100 modules of 200 lines)
+#   python bench_pandoc_server.py 300 100
+
+import json
+import shutil
+import sys
+import time
+
+import pandoc_server
+import pipeline
+import synthetic_lagda
+from generate_macros_json import generate_macros_json
+
+def timed_conversions(sources, macro_data, **options):
+    """
+    Converts every source with pipeline.convert. Returns (the outputs, the total time).
+    """
+    start = time.perf_counter()
+    outputs = [pipeline.convert(source, macro_data, **options) for source in sources]
+    return outputs, time.perf_counter() - start
+
+if __name__ == "__main__":
+    if shutil.which("pandoc") is None:
+        print("Error: pandoc not found on the PATH", file=sys.stderr)
+        sys.exit(1)
+    modules = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    lines = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    with open(synthetic_lagda.default_seed_sty, 'r', encoding='utf-8') as f_sty:
+        macro_data = json.loads(generate_macros_json(f_sty.read()))
+    seeds = synthetic_lagda.load_seeds()
+    sources = [synthetic_lagda.generate_document(lines, 3, seed=i, seeds=seeds) for i in range(modules)]
+    try:
+        server_process, server = pandoc_server.start_server()
+    except RuntimeError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        pipeline.convert(sources[0], macro_data, pandoc_server=server) # Opens the connection
+        results = {
+            "spawn": timed_conversions(sources, macro_data),
+            "server": timed_conversions(sources, macro_data, pandoc_server=server),
+        }
+    finally:
+        server_process.terminate()
+    if not server.available:
+        print("Error: the pandoc server stopped answering", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"{modules} modules of {lines} lines")
+    reference, _ = results["spawn"]
+    for mode, (outputs, seconds) in results.items():
+        if outputs != reference:
+            print(f"Error: {mode} output differs from spawn output", file=sys.stderr)
+            sys.exit(1)
+        print(f"  {mode:<8} {seconds:>7.3f}s  {seconds / modules * 1000:>7.2f} ms/file")
@@ -0,0 +1,216 @@
+# bench_pipeline.py
+# Purpose: Times each stage of the pipeline on synthetic documents of increasing size
+#          (generated by synthetic_lagda.py from Transaction.lagda and macros.sty), and flags
+#          regressions against a locally saved baseline.
+# Stages:
+#   generate_macros_json - parsing macros.sty (the same input in every scenario)
+#   preprocess_lagda     - the preprocessing scan
+#   re.sub passes        - the chain of re.sub passes the scan replaced (fuzz_preprocess.py),
+#                          on the same document; the speedup of the scan over it is printed
+#   pandoc+filter        - Pandoc with agda-filter.lua (skipped if pandoc is not on the PATH)
+#   postprocess          - postprocess_markdown; without Pandoc it runs on the preprocessed
+#                          LaTeX with the admonition markers escaped as Pandoc would
+# For each stage the best time of --repeat runs and the throughput (input MB/s) are reported,
+# and for each scenario the peak RSS of the Python process and of Pandoc. Every scenario runs
+# in a fresh interpreter, so the peak RSS of one does not carry over to the next.
+#
+# USAGE:
+#   python bench_pipeline.py                         (all scenarios)
+#   python bench_pipeline.py 1k 10k --repeat 5
+#   python bench_pipeline.py --save-baseline         (writes/updates bench_baseline.json)
+#   python bench_pipeline.py --lines 50000 --code-blocks 500 --nesting 4   (one custom scenario)
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import time
+
+import fuzz_preprocess
+import pipeline
+import postprocess
+import preprocess
+import synthetic_lagda
+from generate_macros_json import generate_macros_json
+
+# name: (lines, code blocks, macro density, nesting depth, \hldiff count)
+scenarios = {
+    "1k": (1000, 10, 0.05, 1, 10),
+    "10k": (10000, 100, 0.05, 2, 100),
+    "100k": (100000, 1000, 0.05, 2, 1000),
+    "100k-10k-blocks": (100000, 10000, 0.05, 1, 1000),
+    "10k-dense-macros": (10000, 100, 0.5, 1, 100),
+    "10k-deep-nesting": (10000, 100, 0.05, 16, 100),
+    "10k-many-hldiffs": (10000, 100, 0.05, 1, 5000),
+}
+stages = ["generate_macros_json", "preprocess_lagda", "re.sub passes", "pandoc+filter", "postprocess"]
+default_baseline_file = "bench_baseline.json"
+# Differences below this many seconds are noise and never flagged
+noise_floor = 0.005
+
+def peak_rss_kb(who):
+    """
+    Returns the peak resident set size in KiB of this process (who=RUSAGE_SELF) or of its
+    finished children (RUSAGE_CHILDREN). ru_maxrss is in bytes on macOS, in KiB elsewhere.
+    """
+    peak = resource.getrusage(who).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+def best_time(repeat, function, *args):
+    """
+    Runs function repeat times and returns (its last result, the shortest wall time).
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+def run_scenario(parameters, repeat):
+    """
+    Generates the document for one scenario and times every stage on it.
+    Returns:
+        dict: { "lines", "input_bytes", "stages": { stage: {"seconds", "mb_per_s"} or None },
+                "peak_rss_kb", "pandoc_peak_rss_kb" }
+    """
+    lines, code_blocks, macro_density, nesting, hldiffs = parameters
+    with open(synthetic_lagda.default_seed_sty, 'r', encoding='utf-8') as f_sty:
+        sty_content = f_sty.read()
+    source = synthetic_lagda.generate_document(lines, code_blocks, macro_density, nesting, hldiffs)
+    results = {}
+
+    def record(stage, input_text, seconds):
+        size = len(input_text.encode('utf-8'))
+        results[stage] = {"seconds": seconds, "mb_per_s": size / seconds / 1e6 if seconds else None}
+
+    macros_json, seconds = best_time(repeat, generate_macros_json, sty_content)
+    record("generate_macros_json", sty_content, seconds)
+    macro_data = json.loads(macros_json)
+
+    def preprocess_once():
+        state = preprocess.PreprocessState(macro_data)
+        return preprocess.preprocess_lagda(source, state), state
+    (latex_content, state), seconds = best_time(repeat, preprocess_once)
+    record("preprocess_lagda", source, seconds)
+    _, seconds = best_time(repeat, fuzz_preprocess.reference_preprocess, source, macro_data)
+    record("re.sub passes", source, seconds)
+
+    if shutil.which("pandoc"):
+        intermediate_content, seconds = best_time(repeat, pipeline.run_pandoc, latex_content)
+        record("pandoc+filter", latex_content, seconds)
+    else:
+        results["pandoc+filter"] = None
+        intermediate_content = latex_content.replace("@@ADMONITION_START|", "@@ADMONITION_START\\|")
+
+    _, seconds = best_time(repeat, postprocess.postprocess_markdown, intermediate_content, state.code_blocks_data)
+    record("postprocess", intermediate_content, seconds)
+
+    return {
+        "lines": source.count('\n'),
+        "input_bytes": len(source.encode('utf-8')),
+        "stages": results,
+        "peak_rss_kb": peak_rss_kb(resource.RUSAGE_SELF),
+        "pandoc_peak_rss_kb": peak_rss_kb(resource.RUSAGE_CHILDREN) if results["pandoc+filter"] else None,
+    }
+
+def run_scenario_in_child(parameters, repeat):
+    """
+    Runs run_scenario in a fresh Python process and returns its result.
+    """
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-scenario", json.dumps(parameters),
+                             "--repeat", str(repeat)], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"scenario {parameters} failed: {result.stderr.strip()}")
+    return json.loads(result.stdout)
+
+def find_regressions(results, baseline, tolerance):
+    """
+    Compares stage times with the baseline.
+    Returns:
+        list[str]: One message per stage that got more than tolerance (e.g. 0.25 = 25%) slower.
+    """
+    regressions = []
+    for name, result in results.items():
+        for stage, timing in result["stages"].items():
+            reference = baseline.get(name, {}).get("stages", {}).get(stage)
+            if not timing or not reference:
+                continue
+            if timing["seconds"] > reference["seconds"] * (1 + tolerance) and \
+               timing["seconds"] - reference["seconds"] > noise_floor:
+                regressions.append(f"{name} {stage}: {timing['seconds']:.3f}s "
+                                   f"(baseline {reference['seconds']:.3f}s)")
+    return regressions
+
+def print_results(name, result):
+    print(f"{name}: {result['lines']} lines, {result['input_bytes'] / 1e6:.2f} MB, "
+          f"peak RSS {result['peak_rss_kb'] / 1024:.1f} MiB"
+          + (f" (pandoc {result['pandoc_peak_rss_kb'] / 1024:.1f} MiB)" if result['pandoc_peak_rss_kb'] else ""))
+    for stage in stages:
+        timing = result["stages"][stage]
+        if timing is None:
+            print(f"  {stage:<22} skipped (pandoc not found)")
+        else:
+            throughput = f"{timing['mb_per_s']:>9.2f} MB/s" if timing["mb_per_s"] else ""
+            print(f"  {stage:<22} {timing['seconds']:>8.4f}s {throughput}")
+    scan, passes = result["stages"]["preprocess_lagda"], result["stages"].get("re.sub passes")
+    if passes and scan["seconds"]:
+        print(f"  preprocess_lagda is {passes['seconds'] / scan['seconds']:.1f}x as fast as the re.sub passes")
+
+# --- Script Entry Point ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic documents.")
+    parser.add_argument("scenarios", nargs="*", help=f"scenarios to run: {', '.join(scenarios)} (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage; the best time is kept")
+    parser.add_argument("--baseline", default=default_baseline_file, help="baseline file to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="slowdown relative to the baseline that counts as a regression (default: 0.25)")
+    parser.add_argument("--lines", type=int, help="custom scenario: number of lines")
+    parser.add_argument("--code-blocks", type=int, default=100, help="custom scenario: number of code blocks")
+    parser.add_argument("--macro-density", type=float, default=0.05, help="custom scenario: macro density")
+    parser.add_argument("--nesting", type=int, default=1, help="custom scenario: environment nesting depth")
+    parser.add_argument("--hldiffs", type=int, default=100, help="custom scenario: number of \\hldiff")
+    parser.add_argument("--run-scenario", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        json.dump(run_scenario(json.loads(args.run_scenario), args.repeat), sys.stdout)
+        sys.exit(0)
+
+    unknown = [name for name in args.scenarios if name not in scenarios]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    if args.lines:
+        selected = {"custom": (args.lines, args.code_blocks, args.macro_density, args.nesting, args.hldiffs)}
+    else:
+        selected = {name: scenarios[name] for name in (args.scenarios or scenarios)}
+
+    results = {}
+    for name, parameters in selected.items():
+        results[name] = run_scenario_in_child(parameters, args.repeat)
+        print_results(name, results[name])
+
+    if args.save_baseline:
+        # Scenarios that were not run keep their previous baseline
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, 'r', encoding='utf-8') as f_baseline:
+                baseline = json.load(f_baseline)
+        baseline.update(results)
+        with open(args.baseline, 'w', encoding='utf-8') as f_baseline:
+            json.dump(baseline, f_baseline, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f_baseline:
+            regressions = find_regressions(results, json.load(f_baseline), args.tolerance)
+        if regressions:
+            print(f"Regressions against {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}.")
@@ -0,0 +1,105 @@
+# bench_stream_memory.py
+# Purpose: Shows that `preprocess.py --stream` preprocesses a concatenated spec in bounded
+#          memory, by comparing its peak RSS with that of the whole-file mode on inputs made of
+#          10, 100, ... copies of Transaction.lagda (as for the monolithic build, where all
+#          modules are fed to the pipeline as one file).
+# For each size, preprocess.py runs as a child process in both modes (whole, stream) and
+# with both code block outputs (.json, .idx); its peak RSS is that of the child alone
+# (os.wait4). The outputs of the two modes are checked to be the same: identical LaTeX,
+# the same code blocks dictionary (the entries of the streamed JSON may come in another
+# order) and the same index.
+#
+# USAGE:
+#   python bench_stream_memory.py                 (10x, 100x and 1000x Transaction.lagda)
+#   python bench_stream_memory.py 10 100 --source Transaction.lagda
+
+import argparse
+import filecmp
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from generate_macros_json import generate_macros_json
+
+here = os.path.dirname(os.path.abspath(__file__))
+modes = {"whole": [], "stream": ["--stream"]}
+
+def write_concatenation(source_path, copies, path):
+    """
+    Writes copies of the source file one after the other to path, a blank line apart.
+    Returns the size of the result in bytes.
+    """
+    with open(source_path, 'rb') as f_source:
+        source = f_source.read().rstrip(b'\n') + b'\n\n'
+    with open(path, 'wb') as f_out:
+        for _ in range(copies):
+            f_out.write(source)
+    return len(source) * copies
+
+def run_preprocess(mode, lagda_path, macros_path, code_blocks_path, output_path):
+    """
+    Runs preprocess.py in the given mode. Returns (peak RSS of the child in KiB, seconds).
+    ru_maxrss is in bytes on macOS, in KiB elsewhere.
+    """
+    start = time.perf_counter()
+    with open(output_path, 'wb') as f_out:
+        process = subprocess.Popen([sys.executable, os.path.join(here, "preprocess.py"), *modes[mode],
+                                    lagda_path, macros_path, code_blocks_path],
+                                   stdout=f_out, stderr=subprocess.DEVNULL)
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    seconds = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(f"preprocess.py ({mode}) failed with exit code {process.returncode}")
+    peak = usage.ru_maxrss
+    return (peak // 1024 if sys.platform == "darwin" else peak), seconds
+
+def same_file(path_a, path_b):
+    # Compared block by block: a child forked after this process grew would start with its peak RSS
+    return filecmp.cmp(path_a, path_b, shallow=False)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Peak memory of preprocess.py, whole-file vs --stream.")
+    parser.add_argument("copies", nargs="*", type=int, default=[10, 100, 1000],
+                        help="Sizes of the input, in copies of the source (default: 10 100 1000).")
+    parser.add_argument("--source", default=os.path.join(here, "Transaction.lagda"), help="The module to concatenate.")
+    parser.add_argument("--sty", default=os.path.join(here, "macros.sty"), help="The macros of the module.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        macros_path = os.path.join(work_dir, "macros.json")
+        with open(args.sty, 'r', encoding='utf-8') as f_sty, open(macros_path, 'w', encoding='utf-8') as f_json:
+            f_json.write(generate_macros_json(f_sty.read()))
+
+        print(f"{'input':>16}  {'sidecar':<7} " + "  ".join(f"{mode + ' RSS':>12} {'time':>7}" for mode in modes))
+        failed = False
+        for copies in args.copies:
+            lagda_path = os.path.join(work_dir, f"spec{copies}.lagda")
+            size = write_concatenation(args.source, copies, lagda_path)
+            for extension in (".json", ".idx"):
+                results = {}
+                for mode in modes:
+                    code_blocks_path = os.path.join(work_dir, f"code_blocks.{mode}{extension}")
+                    output_path = os.path.join(work_dir, f"spec.{mode}.temp")
+                    results[mode] = run_preprocess(mode, lagda_path, macros_path, code_blocks_path, output_path)
+
+                if not same_file(*(os.path.join(work_dir, f"spec.{mode}.temp") for mode in modes)):
+                    print(f"Error: {copies}x{extension}: the streamed LaTeX differs", file=sys.stderr)
+                    failed = True
+                whole_blocks, stream_blocks = (os.path.join(work_dir, f"code_blocks.{mode}{extension}") for mode in modes)
+                if extension == ".json":
+                    with open(whole_blocks, 'rb') as f_whole, open(stream_blocks, 'rb') as f_stream:
+                        same_blocks = json.load(f_whole) == json.load(f_stream)
+                else:
+                    same_blocks = same_file(whole_blocks, stream_blocks)
+                if not same_blocks:
+                    print(f"Error: {copies}x{extension}: the streamed code blocks differ", file=sys.stderr)
+                    failed = True
+
+                print(f"{copies:>5}x {size / 1e6:>7.2f} MB  {extension:<7} "
+                      + "  ".join(f"{rss / 1024:>8.1f} MiB {seconds:>6.2f}s" for rss, seconds in results.values()))
+            os.unlink(lagda_path)
+    sys.exit(1 if failed else 0)
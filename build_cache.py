@@ -0,0 +1,146 @@
+# build_cache.py
+# Purpose: Content-addressed on-disk cache of the final .lagda.md output of the pipeline.
+# Actions:
+# 1. Derives a cache key from everything the output depends on: the content of the input
+#    .lagda file, the definitions of the macros it references (see macro_index.py; passed in
+#    by the caller), agda-filter.lua, the Pandoc version and the version of these scripts
+#    (tool_version).
+# 2. Returns the cached Markdown on a hit, so preprocess, Pandoc and postprocess can all be
+#    skipped for that file.
+# 3. Keeps the cache below a size limit by evicting the least recently used entries.
+#
+# Entries are stored as <cache_dir>/<first two hex digits of key>/<key>.md; the mtime of an
+# entry records when it was last used.
+
+import hashlib
+import os
+import subprocess
+import tempfile
+
+# Bump whenever a change to the scripts changes their output, to invalidate old entries.
+tool_version = "3"
+default_max_bytes = 512 * 1024 * 1024
+
+def bytes_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+def file_digest(path):
+    """
+    Returns the SHA-256 hex digest of a file's content.
+    """
+    with open(path, 'rb') as f:
+        return bytes_digest(f.read())
+
+def pandoc_version():
+    """
+    Returns Pandoc's version line (e.g., "pandoc 3.1.11"), or "unknown" if it cannot be run.
+    """
+    try:
+        result = subprocess.run(["pandoc", "--version"], capture_output=True, text=True)
+        return result.stdout.splitlines()[0] if result.returncode == 0 and result.stdout else "unknown"
+    except OSError:
+        return "unknown"
+
+def environment_digest(filter_file, filter_mode):
+    """
+    Combines everything the output of every file depends on into one digest.
+    Args:
+        filter_file (str): The Pandoc filter run on every file (agda-filter.lua or agda_filter.py).
+        filter_mode (str): "python" if the filter puts the code blocks in place of their
+            placeholders, "lua" if it leaves them for postprocess_markdown (as agda-filter.lua).
+    """
+    parts = [tool_version, pandoc_version(), file_digest(filter_file), filter_mode]
+    return bytes_digest('\0'.join(parts).encode('utf-8'))
+
+class BuildCache:
+    """
+    Size-bounded LRU cache of converted files, keyed by content hashes.
+    Instances are cheap and picklable, so each worker process can use its own.
+    """
+
+    def __init__(self, cache_dir, environment, max_bytes=default_max_bytes):
+        """
+        Args:
+            cache_dir (str): Directory holding the cache entries (created if missing).
+            environment (str): Digest from environment_digest().
+            max_bytes (int): Size limit enforced by evict().
+        """
+        self.cache_dir = cache_dir
+        self.environment = environment
+        self.max_bytes = max_bytes
+
+    def key_for(self, source_bytes, dependencies=""):
+        """
+        Returns the cache key for an input file with the given content.
+        Args:
+            dependencies (str): Digest of anything else this particular file depends on
+                (e.g., macro_index.definitions_digest).
+        """
+        return bytes_digest(f"{self.environment}\0{dependencies}\0".encode('utf-8') + source_bytes)
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".md")
+
+    def get(self, key):
+        """
+        Returns the cached Markdown for key, or None on a miss. A hit marks the entry as
+        recently used.
+        """
+        path = self.entry_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass # Evicted concurrently; the content we read is still valid
+        return content
+
+    def put(self, key, content):
+        """
+        Stores the Markdown for key. The entry is written to a temporary file and renamed
+        into place, so concurrent readers never see a partial entry.
+        """
+        path = self.entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def evict(self):
+        """
+        Removes least recently used entries until the cache fits in max_bytes.
+        Returns:
+            int: The number of entries removed.
+        """
+        entries = []
+        total = 0
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                if not filename.endswith(".md"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
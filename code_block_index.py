@@ -0,0 +1,139 @@
+# code_block_index.py
+# Purpose: Compact binary alternative to code_blocks.json that stores where each code block
+#          is in the source .lagda file instead of a copy of its content.
+# Actions:
+# 1. write_index stores, for each code block placeholder, the (start, end) byte offsets of the
+#    code in the source file and its hidden status, together with the path and SHA-256 of
+#    the source file.
+# 2. CodeBlockIndex reads such a file, checks that the source is unchanged and slices the
+#    code of each block directly out of a memory map of the source when it is asked for.
+# The code in the final output is thus taken byte for byte from the source file.
+#
+# File layout (little-endian):
+#   header: magic (8 bytes), format version (uint32), number of entries (uint32),
+#           SHA-256 of the source (32 bytes), length of the source path (uint32), path (UTF-8)
+#   entry:  placeholder hash (8 bytes), start offset (uint64), end offset (uint64), hidden (bool)
+
+import hashlib
+import mmap
+import os
+import re
+import struct
+
+from output_writer import ChangedFileWriter
+
+magic = b"LAGDAIDX"
+format_version = 1
+header_struct = struct.Struct("<8sII32sI")
+entry_struct = struct.Struct("<8sQQ?")
+placeholder_pattern = re.compile(r'@@CODEBLOCK_ID_([0-9a-f]{16})@@')
+
+def is_index_file(path):
+    """
+    Returns True if path is a code block index (rather than a code_blocks.json file).
+    """
+    with open(path, 'rb') as f:
+        return f.read(len(magic)) == magic
+
+def byte_spans(content, char_spans):
+    """
+    Converts character offsets into content to byte offsets into its UTF-8 encoding.
+    Args:
+        content (str): The text the offsets refer to.
+        char_spans (dict): { placeholder_id: (start, end, hidden) } in characters.
+    Returns:
+        dict: { placeholder_id: (start, end, hidden) } in bytes.
+    """
+    if content.isascii():
+        return dict(char_spans)
+    offsets = {}
+    for start, end, _ in char_spans.values():
+        offsets[start] = offsets[end] = None
+    char_pos = byte_pos = 0
+    for char_offset in sorted(offsets):
+        byte_pos += len(content[char_pos:char_offset].encode('utf-8'))
+        char_pos = char_offset
+        offsets[char_offset] = byte_pos
+    return {placeholder_id: (offsets[start], offsets[end], hidden)
+            for placeholder_id, (start, end, hidden) in char_spans.items()}
+
+def write_index(path, source_path, spans):
+    """
+    Writes a code block index (only if its content changes, see output_writer.py).
+    Args:
+        path (str): The index file to write.
+        source_path (str): The .lagda file the offsets refer to.
+        spans (dict): { placeholder_id: (start, end, hidden) } in bytes (see byte_spans).
+    Returns:
+        bool: True if the index file was written.
+    """
+    digest = hashlib.sha256()
+    with open(source_path, 'rb') as f_source:
+        # Read in blocks: the source may be a whole concatenated spec
+        for block in iter(lambda: f_source.read(1024 * 1024), b''):
+            digest.update(block)
+    source_digest = digest.digest()
+    encoded_path = os.path.abspath(source_path).encode('utf-8')
+    with ChangedFileWriter(path) as f:
+        f.write(header_struct.pack(magic, format_version, len(spans), source_digest, len(encoded_path)))
+        f.write(encoded_path)
+        for placeholder_id, (start, end, hidden) in spans.items():
+            key = bytes.fromhex(placeholder_pattern.fullmatch(placeholder_id).group(1))
+            f.write(entry_struct.pack(key, start, end, hidden))
+    return f.changed
+
+class CodeBlockIndex:
+    """
+    Read-only view of a code block index, usable wherever the code_blocks.json dictionary is
+    (postprocess.format_code_block only calls get). Use as a context manager, or call close().
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): The index file written by write_index.
+        Raises:
+            ValueError: If the file is not a code block index, or the source file has changed.
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+        found_magic, version, count, source_digest, path_length = header_struct.unpack_from(data)
+        if found_magic != magic or version != format_version:
+            raise ValueError(f"{path} is not a code block index (version {format_version})")
+        pos = header_struct.size
+        self.source_path = data[pos:pos + path_length].decode('utf-8')
+        pos += path_length
+        self.entries = {}
+        for key, start, end, hidden in entry_struct.iter_unpack(data[pos:pos + count * entry_struct.size]):
+            self.entries[f"@@CODEBLOCK_ID_{key.hex()}@@"] = (start, end, hidden)
+
+        with open(self.source_path, 'rb') as f_source:
+            self.source = mmap.mmap(f_source.fileno(), 0, access=mmap.ACCESS_READ) \
+                if os.fstat(f_source.fileno()).st_size else b""
+        if hashlib.sha256(self.source).digest() != source_digest:
+            self.close()
+            raise ValueError(f"{self.source_path} has changed since {path} was written")
+
+    def get(self, placeholder_id, default=None):
+        """
+        Returns {"content": ..., "hidden": ...} for the placeholder, like the entries of
+        code_blocks.json, or default if the placeholder is unknown.
+        """
+        entry = self.entries.get(placeholder_id)
+        if entry is None:
+            return default
+        start, end, hidden = entry
+        return {"content": self.source[start:end].decode('utf-8'), "hidden": hidden}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def close(self):
+        if isinstance(self.source, mmap.mmap):
+            self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,320 @@
+# convert_tree.py
+# Purpose: Converts every LaTeX-based literate Agda file (.lagda) under a directory tree
+#          into a Markdown-based literate Agda file (.lagda.md) in a single invocation.
+# Actions:
+# 1. Loads the macro definitions (preprocess_macros.json) once, in the parent process.
+# 2. Distributes the per-file pipeline (pipeline.run_pipeline) across a pool of worker processes
+#    (one per available core by default):
+#      preprocess_lagda -> pandoc + agda-filter.lua -> postprocess_markdown
+# 3. Writes <name>.lagda.md next to each <name>.lagda input. Files whose output is already in
+#    the build cache (see build_cache.py) skip all three steps. The cache key of a file only
+#    covers the macros it references (see macro_index.py), so a change to the macros only
+#    rebuilds the files using a changed macro; the macro index in the cache directory records
+#    which files those are. With --segments, Pandoc only
+#    converts the paragraphs that are not in the segment cache (see segment_cache.py).
+#    With --filter-engine python, agda_filter.py (on Pandoc's JSON AST) replaces
+#    agda-filter.lua and also inserts the code blocks. With --shards N, each file is split at
+#    its sections and converted by up to N concurrent Pandoc processes (see section_shards.py).
+#    With --pandoc-server, one long-lived `pandoc server` serves all workers instead of a
+#    Pandoc process per file (see pandoc_server.py); if it cannot start, Pandoc runs as usual.
+#    With --manifest, also writes <name>.lagda.manifest.json: the Agda terms, code blocks and
+#    headings of the module, collected during the same conversion (see manifest.py).
+#    Outputs are only rewritten (atomically) when their content changes, so tools watching them
+#    only see the modules that really changed (see output_writer.py).
+# 4. Prints a per-file success/failure summary, with the number of output files actually
+#    written; a failing file does not abort the others.
+# 5. With --trace FILE, writes the time, bytes and substitution counts of each stage per file
+#    (see instrumentation.py); with --profile FILE, writes the merged cProfile statistics of all
+#    conversions (readable with python -m pstats FILE).
+#
+# USAGE:
+#   python convert_tree.py src/Ledger preprocess_macros.json
+#   python convert_tree.py src/Ledger preprocess_macros.json --jobs 4
+#   python convert_tree.py src/Ledger preprocess_macros.json --no-cache
+#   python convert_tree.py src/Ledger preprocess_macros.json --segments
+#   python convert_tree.py src/Ledger preprocess_macros.json --filter-engine python
+#   python convert_tree.py src/Ledger preprocess_macros.json --pandoc-server
+#   python convert_tree.py src/Ledger preprocess_macros.json --manifest
+#   python convert_tree.py src/Ledger preprocess_macros.json --no-cache --trace trace.json --profile run.prof
+
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import build_cache
+import instrumentation
+import macro_index
+import manifest
+import output_writer
+import pandoc_server
+import pipeline
+
+# --- Configuration ---
+default_cache_dir = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+                                 "fls-md-transition")
+
+def default_jobs():
+    """
+    Returns the number of cores available to this process (falls back to os.cpu_count()).
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def find_lagda_files(root):
+    """
+    Recursively collects all .lagda files below root, in a stable (sorted) order.
+    Args:
+        root (str): Directory to search (e.g., src/Ledger).
+    Returns:
+        list[str]: Paths of the .lagda files found.
+    """
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith(".lagda"):
+                found.append(os.path.join(dirpath, filename))
+    return found
+
+# --- Worker Functions ---
+
+# The macro table, build cache and segment cache used by this worker (caches are None if disabled)
+worker_macro_data = {}
+worker_cache = None
+worker_segment_cache = None
+# "lua" (agda-filter.lua) or "python" (agda_filter.py)
+worker_filter_engine = "lua"
+# Whether each conversion is traced, and the directory receiving the cProfile dumps (None: no profiling)
+worker_trace = False
+worker_profile_dir = None
+# Maximum number of concurrent Pandoc processes per file, and the Pandoc server (None: subprocesses)
+worker_shards = 1
+worker_pandoc_server = None
+# Whether a manifest is written next to each output
+worker_manifest = False
+
+def init_worker(loaded_macro_data, cache, segments, filter_engine, trace=False, profile_dir=None, shards=1,
+                server=None, write_manifest=False):
+    """
+    Process pool initializer: installs the macro table (loaded once by the parent)
+    in the worker, along with the caches, filter engine and instrumentation settings.
+    """
+    global worker_macro_data, worker_cache, worker_segment_cache, worker_filter_engine
+    global worker_trace, worker_profile_dir, worker_shards, worker_pandoc_server, worker_manifest
+    worker_macro_data = loaded_macro_data
+    worker_cache = cache
+    worker_segment_cache = segments
+    worker_filter_engine = filter_engine
+    worker_trace = trace
+    worker_profile_dir = profile_dir
+    worker_shards = shards
+    worker_pandoc_server = server
+    worker_manifest = write_manifest
+
+def profile_conversion(input_lagda_file):
+    """
+    Runs convert_file under cProfile and dumps the statistics into the profile directory.
+    Returns:
+        tuple: The result of convert_file, followed by the path of the dump.
+    """
+    profiler = cProfile.Profile()
+    result = profiler.runcall(convert_file, input_lagda_file)
+    fd, profile_file = tempfile.mkstemp(suffix=".prof", dir=worker_profile_dir)
+    os.close(fd)
+    profiler.dump_stats(profile_file)
+    return (*result, profile_file)
+
+def manifest_key(cache_key):
+    """
+    Returns the build cache key under which the manifest of the output cached as cache_key is stored.
+    """
+    return build_cache.bytes_digest(f"{cache_key}\0manifest".encode('utf-8'))
+
+def convert_file(input_lagda_file):
+    """
+    Runs the full pipeline for one file and writes <input>.md (and, if enabled, the manifest)
+    next to it. If the build cache already holds the output for this content, the pipeline is skipped.
+    Args:
+        input_lagda_file (str): Path of the .lagda file.
+    Returns:
+        tuple: (input_lagda_file, error message or None on success, True if served from the cache,
+                number of output files written (unchanged ones are not),
+                (segment cache hits, segment cache misses, full conversions),
+                the trace as a dict or None if tracing is off, the macros the file references
+                or None on failure).
+    """
+    trace = instrumentation.Trace() if worker_trace else None
+    module_manifest = manifest.ModuleManifest() if worker_manifest else None
+    manifest_json = None
+    try:
+        with open(input_lagda_file, 'rb') as f_lagda:
+            input_bytes = f_lagda.read()
+        source = input_bytes.decode('utf-8')
+        referenced = macro_index.referenced_macros(source)
+        cache_key = final_content = None
+        if worker_cache:
+            with pipeline.timed_stage(trace, "build_cache"):
+                macros_digest = macro_index.definitions_digest(worker_macro_data, referenced)
+                cache_key = worker_cache.key_for(input_bytes, macros_digest)
+                final_content = worker_cache.get(cache_key)
+                if final_content is not None and worker_manifest:
+                    manifest_json = worker_cache.get(manifest_key(cache_key))
+                    if manifest_json is None:
+                        final_content = None # Converted again for the manifest
+        cached = final_content is not None
+        segment_stats = (0, 0, 0)
+        if not cached:
+            final_content, segment_stats = pipeline.run_pipeline(
+                source, worker_macro_data, worker_filter_engine, worker_segment_cache, trace, worker_shards,
+                worker_pandoc_server, module_manifest)
+            if module_manifest:
+                manifest_json = module_manifest.to_json()
+        with pipeline.timed_stage(trace, "write"):
+            written = output_writer.write_if_changed(input_lagda_file + ".md", final_content)
+            if manifest_json is not None:
+                written += output_writer.write_if_changed(input_lagda_file + ".manifest.json", manifest_json)
+            if worker_cache and not cached:
+                worker_cache.put(cache_key, final_content)
+                if manifest_json is not None:
+                    worker_cache.put(manifest_key(cache_key), manifest_json)
+        if trace:
+            trace.count("build_cache_hits" if cached else "build_cache_misses")
+        return input_lagda_file, None, cached, written, segment_stats, trace.to_dict() if trace else None, referenced
+    except FileNotFoundError as e:
+        return input_lagda_file, f"file not found: {e.filename}", False, 0, (0, 0, 0), None, None
+    except Exception as e:
+        return input_lagda_file, str(e), False, 0, (0, 0, 0), None, None
+
+# --- Script Entry Point ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert all .lagda files under a directory to .lagda.md.")
+    parser.add_argument("source_dir", help="directory to search recursively for .lagda files")
+    parser.add_argument("macros_json", help="macro definitions generated by generate_macros_json.py")
+    parser.add_argument("--jobs", "-j", type=int, default=default_jobs(),
+                        help="number of worker processes (default: available cores)")
+    parser.add_argument("--cache-dir", default=default_cache_dir,
+                        help=f"build cache directory (default: {default_cache_dir})")
+    parser.add_argument("--cache-max-mb", type=int, default=build_cache.default_max_bytes // (1024 * 1024),
+                        help="size limit of the build cache in MiB; least recently used entries are evicted")
+    parser.add_argument("--no-cache", action="store_true", help="always run the full pipeline")
+    parser.add_argument("--segments", action="store_true",
+                        help="cache Pandoc output per paragraph and only convert the paragraphs that changed")
+    parser.add_argument("--filter-engine", choices=pipeline.filter_engines, default="lua",
+                        help="agda-filter.lua, or agda_filter.py on Pandoc's JSON AST (default: lua)")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="split each file at its sections and run up to this many Pandoc processes "
+                             "at once (for a few large files; default: 1)")
+    parser.add_argument("--pandoc-server", action="store_true",
+                        help="convert through one long-lived local pandoc server instead of a pandoc process per file")
+    parser.add_argument("--manifest", action="store_true",
+                        help="also write <name>.lagda.manifest.json (Agda terms, code blocks, headings)")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="write the time, bytes and counts of each stage per file as JSON")
+    parser.add_argument("--profile", metavar="FILE", help="write the cProfile statistics of the conversions")
+    args = parser.parse_args()
+    if args.segments and args.no_cache:
+        parser.error("--segments needs the build cache (remove --no-cache)")
+
+    try:
+        print(f"Loading macro definitions from {args.macros_json}", file=sys.stderr)
+        with open(args.macros_json, 'r', encoding='utf-8') as f_json:
+            loaded_macro_data = json.load(f_json)
+        print(f"Loaded {len(loaded_macro_data.get('agda_terms', {}))} Agda term macros.", file=sys.stderr)
+    except FileNotFoundError as e:
+        print(f"Error: Input file not found: {e.filename}", file=sys.stderr)
+        sys.exit(1)
+    except json.JSONDecodeError as e:
+        print(f"Error: Failed to parse JSON file {args.macros_json}: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    input_files = find_lagda_files(args.source_dir)
+    if not input_files:
+        print(f"No .lagda files found under {args.source_dir}", file=sys.stderr)
+        sys.exit(1)
+    jobs = max(1, min(args.jobs, len(input_files)))
+    print(f"Converting {len(input_files)} files with {jobs} worker processes...", file=sys.stderr)
+
+    server_process, server = None, None
+    if args.pandoc_server:
+        try:
+            server_process, server = pandoc_server.start_server()
+        except RuntimeError as e:
+            print(f"Warning: {e}; running pandoc per file.", file=sys.stderr)
+
+    cache = None
+    segments = None
+    index = None
+    if not args.no_cache:
+        # The server runs agda_filter.py whatever the filter engine, but only the Python engine
+        # has it insert the code blocks, so both the filter and the engine go into the key
+        use_python_filter = args.filter_engine == "python" or server is not None
+        filter_file = pipeline.python_filter_file if use_python_filter else pipeline.lua_filter_file
+        environment = build_cache.environment_digest(filter_file, args.filter_engine)
+        cache = build_cache.BuildCache(args.cache_dir, environment, args.cache_max_mb * 1024 * 1024)
+        if args.segments:
+            # Segment entries live below the cache directory, so cache.evict() covers them too
+            segments = build_cache.BuildCache(os.path.join(args.cache_dir, "segments"), environment)
+        index = macro_index.MacroIndex(os.path.join(args.cache_dir, "macro_index.json"))
+
+    failures = []
+    cache_hits = 0
+    outputs_written = 0
+    segment_totals = [0, 0, 0]
+    traces = {}
+    profile_dir = tempfile.mkdtemp(prefix="convert_tree_profile_") if args.profile else None
+    profile_stats = None
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                             initargs=(loaded_macro_data, cache, segments, args.filter_engine,
+                                       bool(args.trace), profile_dir, args.shards, server, args.manifest)) as pool:
+        for input_lagda_file, error, cached, written, segment_stats, trace, referenced, *profile_file in \
+                pool.map(profile_conversion if profile_dir else convert_file, input_files):
+            if trace:
+                traces[input_lagda_file] = trace
+            if profile_file:
+                if profile_stats is None:
+                    profile_stats = pstats.Stats(profile_file[0])
+                else:
+                    profile_stats.add(profile_file[0])
+                os.remove(profile_file[0])
+            if index is not None and referenced is not None:
+                index.update(os.path.abspath(input_lagda_file), referenced)
+            if error is None:
+                print(f"  {'cached' if cached else 'ok':<8}{input_lagda_file}{'' if written else ' (unchanged)'}")
+                cache_hits += cached
+                outputs_written += written
+                segment_totals = [total + n for total, n in zip(segment_totals, segment_stats)]
+            else:
+                print(f"  FAILED  {input_lagda_file}: {error}")
+                failures.append(input_lagda_file)
+
+    if segments:
+        hits, misses, full_conversions = segment_totals
+        print(f"Segment cache: {hits} hits, {misses} misses, {full_conversions} files converted as a whole.")
+    if server_process:
+        server_process.terminate()
+        server_process.wait()
+    if index is not None:
+        index.save()
+    if cache:
+        evicted = cache.evict()
+        if evicted:
+            print(f"Evicted {evicted} least recently used build cache entries.", file=sys.stderr)
+    if args.trace:
+        instrumentation.write_trace_file(args.trace, traces)
+        print(f"Trace written to {args.trace}", file=sys.stderr)
+    if profile_dir:
+        if profile_stats:
+            profile_stats.dump_stats(args.profile)
+            print(f"Profile written to {args.profile}", file=sys.stderr)
+        os.rmdir(profile_dir)
+
+    print(f"{outputs_written} output files written (unchanged ones are left as they were).")
+    print(f"{len(input_files) - len(failures)} succeeded ({cache_hits} from the build cache), {len(failures)} failed.")
+    if failures:
+        sys.exit(1)
@@ -0,0 +1,123 @@
+# fuzz_preprocess.py
+# Purpose: Regression check of the single-pass scanner of preprocess_lagda against the chain
+#          of re.sub passes it replaced (reproduced here as reference_preprocess), on random
+#          documents mixing code blocks, wrapper lines, \modulenote, Agda term macros, \hldiff,
+#          braces and whitespace.
+# The documents are random, but within the input on which both are meant to agree:
+# - code blocks are well-formed (every \begin{code} has its \end{code}, none is nested). For
+#   an unterminated \begin{code} followed by a [hide] block, the old passes captured the
+#   hidden block first while the scanner takes the outer one;
+# - \hldiff arguments hold no braces (the old passes closed them at the first '}', the
+#   scanner at the matching brace);
+# - \\ is never directly followed by a control word (the old passes matched \hldiff, \begin
+#   and macros right after the \\ line break).
+# The LaTeX output and the code blocks (content, hidden status and storing order) must be
+# identical. Exits with 1 and prints the first mismatching document otherwise.
+#
+# USAGE:
+#   python fuzz_preprocess.py                        (20000 documents)
+#   python fuzz_preprocess.py --documents 100000 --seed 7
+
+import argparse
+import json
+import random
+import re
+import sys
+
+import preprocess
+import synthetic_lagda
+from generate_macros_json import generate_macros_json
+
+def reference_preprocess(content, macro_data):
+    """
+    The preprocessing of preprocess_lagda as the sequence of re.sub passes it replaced (with
+    the content-hash placeholders of process_code_block).
+    Returns:
+        tuple: (processed LaTeX, code blocks data).
+    """
+    state = preprocess.PreprocessState(macro_data)
+    content = re.sub(r'\\begin\{code\}\s*\[hide\](.*?)\\end\{code\}',
+                     lambda m: preprocess.process_code_block(state, m.group(1), True), content, flags=re.DOTALL)
+    content = re.sub(r'\\begin\{code\}(.*?)\\end\{code\}',
+                     lambda m: preprocess.process_code_block(state, m.group(1), False), content, flags=re.DOTALL)
+    content = re.sub(r'\\modulenote\{\s*\\LedgerModule\{(.*?)\}\s*\}', preprocess.replace_modulenote_direct, content)
+    if macro_data.get("agda_terms"):
+        agda_term_pattern = r'\\(' + '|'.join(re.escape(k) for k in macro_data["agda_terms"]) + r')\{\}'
+        content = re.sub(agda_term_pattern, lambda m: preprocess.expand_agda_term_placeholder(macro_data, m.group(1)),
+                         content)
+    content = re.sub(r'\\hldiff\{(.*?)\}', lambda m: f"\\HighlightPlaceholder{{{m.group(1)}}}", content, flags=re.DOTALL)
+    content = re.sub(r'^\s*\\begin\{figure\*}(\[[^\]]*\])?\s*?\n', '', content, flags=re.MULTILINE)
+    content = re.sub(r'^\s*\\end\{figure\*\}\s*?\n?', '', content, flags=re.MULTILINE)
+    content = re.sub(r'^\s*\\begin\{AgdaMultiCode\}\s*?\n', '', content, flags=re.MULTILINE)
+    content = re.sub(r'^\s*\\end\{AgdaMultiCode\}\s*?\n?', '', content, flags=re.MULTILINE)
+    content = re.sub(r'^\s*\\begin\{NoConway\}\s*?\n', '', content, flags=re.MULTILINE)
+    content = re.sub(r'^\s*\\end\{NoConway\}\s*?\n?', '', content, flags=re.MULTILINE)
+    content = re.sub(r'^\s*\\begin\{Conway\}\s*?\n', '\n\n@@ADMONITION_START|Conway specifics@@\n\n', content,
+                     flags=re.MULTILINE)
+    content = re.sub(r'^\s*\\end\{Conway\}\s*?\n?', '\n\n@@ADMONITION_END@@\n\n', content, flags=re.MULTILINE)
+    return content, state.code_blocks_data
+
+# --- Random Documents ---
+words = ["text", "x", "a b", "Utxo", "hide", "code", "[hide]", "@"]
+whitespace = ["\n", "\n\n", " ", "  \n", "\t", "\r\n", " \n \n"]
+wrapper_names = ["figure*", "AgdaMultiCode", "NoConway", "Conway"]
+
+def random_text(rng, pieces):
+    return ''.join(rng.choice(words) + rng.choice(whitespace) for _ in range(pieces))
+
+def random_code_block(rng):
+    marker = rng.choice(["", "", "[hide]", " [hide]", "\n[hide]", "[hidden]"])
+    body = ''.join(rng.choice(words + whitespace + ["{", "}", "\\txins{}", "\\hldiff{", "\\begin{Conway}\n"])
+                   for _ in range(rng.randint(0, 6)))
+    return f"\\begin{{code}}{marker}{body}\\end{{code}}"
+
+def random_wrapper(rng):
+    name = rng.choice(wrapper_names)
+    option = rng.choice(["", "[h]", "[t!]"]) if name == "figure*" else ""
+    return (rng.choice(["", "", "  ", "\t", "text "]) + f"\\{rng.choice(['begin', 'end'])}{{{name}}}" + option
+            + rng.choice(["\n", "\n", "  \n", "", " text\n", "\r\n"]))
+
+def random_piece(rng, term_names):
+    kind = rng.randrange(10)
+    if kind == 0:
+        return random_code_block(rng)
+    if kind in (1, 2):
+        return random_wrapper(rng)
+    if kind == 3:
+        name = rng.choice(term_names)
+        return rng.choice([f"\\{name}{{}}", f"\\{name}", f"\\{name}x{{}}", f"\\{name[:-1]}{{}}", f"\\{name}{{ }}"])
+    if kind == 4:
+        return f"\\hldiff{{{random_text(rng, rng.randint(0, 3))}}}"
+    if kind == 5:
+        return rng.choice(["\\modulenote{\\LedgerModule{Utxo}}", "\\modulenote{ \\LedgerModule{Ledger.Utxo} }",
+                           "\\modulenote{\n\\LedgerModule{A}\n}", "\\modulenote{Utxo}", "\\modulenote"])
+    if kind == 6:
+        return rng.choice(["{", "}", "\\{", "\\}", "\\\\ ", "\\foo{}", "\\section{T}"])
+    if kind == 7:
+        return rng.choice(whitespace)
+    return random_text(rng, rng.randint(1, 3))
+
+def random_document(rng, term_names, max_pieces):
+    return ''.join(random_piece(rng, term_names) for _ in range(rng.randint(1, max_pieces)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares preprocess_lagda with the re.sub passes it replaced.")
+    parser.add_argument("--documents", type=int, default=20000, help="Number of random documents (default: 20000).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the first document.")
+    parser.add_argument("--max-pieces", type=int, default=30, help="Maximum number of constructs per document.")
+    args = parser.parse_args()
+
+    with open(synthetic_lagda.default_seed_sty, 'r', encoding='utf-8') as f_sty:
+        macro_data = json.loads(generate_macros_json(f_sty.read()))
+    term_names = sorted(macro_data.get("agda_terms", {}))[:20]
+
+    for i in range(args.documents):
+        document = random_document(random.Random(args.seed + i), term_names, args.max_pieces)
+        expected, expected_blocks = reference_preprocess(document, macro_data)
+        state = preprocess.PreprocessState(macro_data)
+        actual = preprocess.preprocess_lagda(document, state)
+        if actual != expected or list(state.code_blocks_data.items()) != list(expected_blocks.items()):
+            print(f"Mismatch for seed {args.seed + i}:\n  input:    {document!r}\n"
+                  f"  expected: {expected!r}\n  actual:   {actual!r}", file=sys.stderr)
+            sys.exit(1)
+    print(f"{args.documents} documents: preprocess_lagda matches the re.sub passes.")
@@ -1,7 +1,10 @@
 import re
 import json
+import os
 import sys
 
+from output_writer import write_if_changed
+
 def generate_macros_json(sty_content):
     """
     Parses LaTeX .sty content to find simple Agda term macros
@@ -27,8 +30,9 @@ def generate_macros_json(sty_content):
         "//": "Auto-generated by generate_macro_json.py from macros.sty",
         "agda_terms": agda_terms_dict,
         "placeholders": {
-            # Manually add placeholders if needed, e.g.:
-            # "hldiff": "\\\\HighlightPlaceholder{#1}"
+            # Manually add placeholders (macros with arguments) if needed; #1..#n stand
+            # for the arguments, in order. \hldiff is built into preprocess.py, e.g.:
+            # "hldiff": "\\HighlightPlaceholder{#1}"
         }
     }
 
@@ -37,14 +41,42 @@ def generate_macros_json(sty_content):
 
     return json.dumps(output_json, indent=2)
 
+def diff_macro_tables(old_table, new_table):
+    """
+    Compares two macro tables (as loaded from preprocess_macros.json) entry by entry,
+    over both the agda_terms and the placeholders sections.
+    Returns:
+        dict: { "added": [...], "removed": [...], "changed": [...] } macro names, sorted.
+              A macro whose agda_class, basename or template differs counts as changed.
+    """
+    changes = {"added": set(), "removed": set(), "changed": set()}
+    for section in ("agda_terms", "placeholders"):
+        old_entries = old_table.get(section) or {}
+        new_entries = new_table.get(section) or {}
+        for name in new_entries.keys() - old_entries.keys():
+            changes["added"].add(name)
+        for name in old_entries.keys() - new_entries.keys():
+            changes["removed"].add(name)
+        for name in new_entries.keys() & old_entries.keys():
+            if new_entries[name] != old_entries[name]:
+                changes["changed"].add(name)
+    # A macro moved from one section to the other is changed, not added and removed
+    moved = changes["added"] & changes["removed"]
+    changes["changed"] |= moved
+    changes["added"] -= moved
+    changes["removed"] -= moved
+    return {kind: sorted(names) for kind, names in changes.items()}
+
 # --- Main execution part remains the same ---
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print(f"Usage: python {sys.argv[0]} <input_macros_sty_file> <output_macros_json_file>")
+    if len(sys.argv) not in (3, 4):
+        print(f"Usage: python {sys.argv[0]} <input_macros_sty_file> <output_macros_json_file> [output_changes_json_file]")
         sys.exit(1)
 
     input_sty_file = sys.argv[1]
     output_json_file = sys.argv[2]
+    # Optional: where to record the macros added, removed or changed since the previous output
+    output_changes_file = sys.argv[3] if len(sys.argv) == 4 else None
 
     try:
         with open(input_sty_file, 'r', encoding='utf-8') as f:
@@ -52,10 +84,28 @@ if __name__ == "__main__":
 
         json_output = generate_macros_json(sty_input_content)
 
-        with open(output_json_file, 'w', encoding='utf-8') as f:
-            f.write(json_output)
+        previous_table = {}
+        if os.path.exists(output_json_file):
+            try:
+                with open(output_json_file, 'r', encoding='utf-8') as f:
+                    previous_table = json.load(f)
+            except ValueError as e:
+                # A truncated or hand-edited table is regenerated; every macro counts as added
+                print(f"Warning: Could not read the previous {output_json_file} ({e}); regenerating it.",
+                      file=sys.stderr)
+            if not isinstance(previous_table, dict):
+                previous_table = {}
+        changes = diff_macro_tables(previous_table, json.loads(json_output))
 
-        print(f"Successfully generated {output_json_file} from {input_sty_file}")
+        if write_if_changed(output_json_file, json_output):
+            print(f"Successfully generated {output_json_file} from {input_sty_file}")
+        else:
+            print(f"{output_json_file} is up to date (not rewritten)")
+        print(f"{len(changes['added'])} macros added, {len(changes['removed'])} removed, "
+              f"{len(changes['changed'])} changed.")
+        if output_changes_file:
+            with open(output_changes_file, 'w', encoding='utf-8') as f:
+                json.dump(changes, f, indent=2)
 
     except FileNotFoundError:
         print(f"Error: Input file not found: {input_sty_file}", file=sys.stderr)
@@ -0,0 +1,96 @@
+# instrumentation.py
+# Purpose: Structured measurements of a pipeline run, written as a JSON trace file.
+# Records, per trace:
+# 1. Stages (e.g. "preprocess", "pandoc", "postprocess", and the constructs handled inside
+#    the preprocess scan as "preprocess/<construct>"): number of calls, wall time and CPU time
+#    of the calling thread, and input/output bytes where known.
+# 2. Counters of the substitutions made (code blocks, hidden code blocks, Agda terms,
+#    modulenotes, placeholder macros such as \hldiff, admonitions, ...).
+# 3. Unknown macros (control words followed by {} that are not in the macro table), with the
+#    number of occurrences of each, instead of one debug line per occurrence.
+# Traces are plain data (to_dict/merge), so worker processes can send theirs to the parent.
+
+import json
+import time
+from contextlib import contextmanager
+
+trace_format_version = 1
+
+class Trace:
+    """
+    Measurements of one pipeline run (or several, once merged).
+    """
+
+    def __init__(self):
+        self.stages = {}        # { name: {"calls", "wall_s", "cpu_s", "input_bytes", "output_bytes"} }
+        self.counters = {}      # { name: count }
+        self.unknown_macros = {} # { macro name: occurrences }
+
+    def stage_record(self, name):
+        record = self.stages.get(name)
+        if record is None:
+            record = self.stages[name] = {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0,
+                                          "input_bytes": 0, "output_bytes": 0}
+        return record
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Context manager timing one call of a stage (wall time and CPU time of this thread).
+        """
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - wall_start, time.thread_time() - cpu_start)
+
+    def add_time(self, name, wall_s, cpu_s, calls=1):
+        record = self.stage_record(name)
+        record["calls"] += calls
+        record["wall_s"] += wall_s
+        record["cpu_s"] += cpu_s
+
+    def add_bytes(self, name, input_text=None, output_text=None):
+        """
+        Adds the UTF-8 sizes of the input and output text of a stage.
+        """
+        record = self.stage_record(name)
+        if input_text is not None:
+            record["input_bytes"] += len(input_text.encode('utf-8'))
+        if output_text is not None:
+            record["output_bytes"] += len(output_text.encode('utf-8'))
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def unknown_macro(self, name):
+        self.unknown_macros[name] = self.unknown_macros.get(name, 0) + 1
+
+    def to_dict(self):
+        return {"stages": self.stages, "counters": self.counters, "unknown_macros": self.unknown_macros}
+
+    def merge(self, data):
+        """
+        Adds the measurements of another trace (as returned by to_dict) to this one.
+        """
+        for name, record in data["stages"].items():
+            own = self.stage_record(name)
+            for key, value in record.items():
+                own[key] += value
+        for name, count in data["counters"].items():
+            self.count(name, count)
+        for name, count in data["unknown_macros"].items():
+            self.unknown_macros[name] = self.unknown_macros.get(name, 0) + count
+
+def write_trace_file(path, traces):
+    """
+    Writes a JSON trace file holding the trace of each file and their totals.
+    Args:
+        path (str): The file to write.
+        traces (dict): { input file: Trace.to_dict() }.
+    """
+    totals = Trace()
+    for data in traces.values():
+        totals.merge(data)
+    with open(path, 'w', encoding='utf-8') as f_trace:
+        json.dump({"version": trace_format_version, "files": traces, "totals": totals.to_dict()}, f_trace, indent=2)
@@ -0,0 +1,142 @@
+# macro_index.py
+# Purpose: Tracks which modules use which macros, so that a change to macros.sty only
+#          rebuilds the modules that reference a changed macro.
+# Provides:
+# 1. referenced_macros: the control words a module uses. Every macro the preprocessing can
+#    substitute is among them, and so is any macro that is not defined yet (a definition added
+#    later then affects the module).
+# 2. definitions_digest: a digest of the definitions (Agda term entries and placeholder
+#    templates) of just those macros. The build cache keys of convert_tree.py include it
+#    instead of the whole preprocess_macros.json, so editing one macro only misses the cache
+#    for the modules that reference it.
+# 3. MacroIndex: a reverse index from macro name to the modules referencing it, persisted as
+#    JSON, to look up the modules affected by a change (see generate_macros_json.diff_macro_tables).
+#
+# USAGE:
+#   python macro_index.py <macro_index.json> <macro_changes.json>   (lists the modules to rebuild)
+
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+
+from preprocess import default_placeholders
+
+control_word_pattern = re.compile(r'\\([A-Za-z@]+)')
+index_format_version = 1
+
+def referenced_macros(source):
+    """
+    Returns the set of control word names (without the backslash) used in source.
+    """
+    return set(control_word_pattern.findall(source))
+
+def macro_definitions(macro_data, names):
+    """
+    Returns { name: definition } for the names defined in the macro table: the agda_terms
+    entry and/or the effective placeholder template (built in or from the table).
+    """
+    agda_terms = macro_data.get("agda_terms") or {}
+    placeholders = dict(default_placeholders)
+    placeholders.update(macro_data.get("placeholders") or {})
+    definitions = {}
+    for name in names:
+        if name in agda_terms or name in placeholders:
+            definitions[name] = [agda_terms.get(name), placeholders.get(name)]
+    return definitions
+
+def definitions_digest(macro_data, names):
+    """
+    Returns a digest of the definitions of the given macros; it changes exactly when one of
+    them is added, removed or redefined.
+    """
+    definitions = macro_definitions(macro_data, names)
+    return hashlib.sha256(json.dumps(definitions, sort_keys=True).encode('utf-8')).hexdigest()
+
+class MacroIndex:
+    """
+    Reverse index from macro name to the modules referencing it.
+    Stored as { "version": 1, "macros": { name: [module, ...] } }.
+    """
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path (str): JSON file the index is loaded from (if it exists) and saved to;
+                None for an index kept in memory only.
+        """
+        self.path = path
+        self.modules = {} # { module: set of macro names }, the forward direction
+        self.macros = {}  # { macro name: set of modules }
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f_index:
+                data = json.load(f_index)
+            if data.get("version") == index_format_version:
+                for name, modules in data["macros"].items():
+                    for module in modules:
+                        self.add(module, name)
+
+    def add(self, module, name):
+        self.modules.setdefault(module, set()).add(name)
+        self.macros.setdefault(name, set()).add(module)
+
+    def update(self, module, names):
+        """
+        Records the macros a module references, replacing what was recorded before.
+        """
+        self.remove(module)
+        for name in names:
+            self.add(module, name)
+        self.modules.setdefault(module, set())
+
+    def remove(self, module):
+        for name in self.modules.pop(module, ()):
+            modules = self.macros[name]
+            modules.discard(module)
+            if not modules:
+                del self.macros[name]
+
+    def modules_using(self, names):
+        """
+        Returns the set of modules referencing any of the given macros.
+        """
+        affected = set()
+        for name in names:
+            affected |= self.macros.get(name, set())
+        return affected
+
+    def save(self):
+        """
+        Writes the index to its file, atomically (temporary file renamed into place).
+        """
+        data = {"version": index_format_version,
+                "macros": {name: sorted(modules) for name, modules in sorted(self.macros.items())}}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f_index:
+                json.dump(data, f_index)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+# --- Script Entry Point ---
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print(f"Usage: python {sys.argv[0]} <macro_index.json> <macro_changes.json>")
+        sys.exit(1)
+
+    try:
+        index = MacroIndex(sys.argv[1])
+        with open(sys.argv[2], 'r', encoding='utf-8') as f_changes:
+            changes = json.load(f_changes)
+    except FileNotFoundError as e:
+        print(f"Error: Input file not found: {e.filename}", file=sys.stderr)
+        sys.exit(1)
+    changed_names = [name for kind in ("added", "removed", "changed") for name in changes.get(kind, [])]
+    for module in sorted(index.modules_using(changed_names)):
+        print(module)
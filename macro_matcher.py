@@ -0,0 +1,80 @@
+# macro_matcher.py
+# Purpose: Matches LaTeX control sequences against the macro table (preprocess_macros.json).
+# Actions:
+# 1. Stores macro names (without the leading backslash) in a character trie, built once per
+#    macro table and reused for every file.
+# 2. Looks up the longest macro name starting at a given position; the cost depends only on
+#    the length of the name, not on the number of macros in the table.
+# 3. Splits placeholder templates (e.g. "\HighlightPlaceholder{#1}") into the literal
+#    pieces that surround their arguments.
+
+import re
+
+# Key under which a trie node stores the value of the macro ending at that node.
+# The empty string can never collide with a (single) character key.
+TERMINAL = ""
+
+class MacroTrie:
+    """
+    Character trie mapping macro names to arbitrary values.
+    Each node is a dict from the next character to the child node.
+    """
+
+    def __init__(self):
+        self.root = {}
+        self.size = 0
+
+    def add(self, name, value):
+        """
+        Adds (or replaces) the macro name with the given value.
+        Args:
+            name (str): The macro name without the leading backslash (e.g., "txins").
+            value: The value returned by longest_match for this name.
+        """
+        node = self.root
+        for char in name:
+            node = node.setdefault(char, {})
+        if TERMINAL not in node:
+            self.size += 1
+        node[TERMINAL] = value
+
+    def longest_match(self, text, pos):
+        """
+        Finds the longest macro name that text contains at pos.
+        Args:
+            text (str): The text to search.
+            pos (int): Where the name starts (just after the backslash).
+        Returns:
+            tuple: (end position of the name, value), or None if no macro name starts at pos.
+        """
+        node = self.root
+        best = None
+        length = len(text)
+        while pos < length:
+            node = node.get(text[pos])
+            if node is None:
+                break
+            pos += 1
+            if TERMINAL in node:
+                best = (pos, node[TERMINAL])
+        return best
+
+    def __len__(self):
+        return self.size
+
+def split_template(template):
+    """
+    Splits a placeholder template into the literal pieces around its arguments.
+    Example: "\\HighlightPlaceholder{#1}" -> ["\\HighlightPlaceholder{", "}"]
+    Args:
+        template (str): Replacement text using #1 ... #9 for the macro arguments.
+    Returns:
+        list[str]: n+1 pieces for a macro with n arguments.
+    Raises:
+        ValueError: If the arguments are not used once each, in order.
+    """
+    pieces = re.split(r'#(\d)', template)
+    argument_numbers = [int(n) for n in pieces[1::2]]
+    if argument_numbers != list(range(1, len(argument_numbers) + 1)):
+        raise ValueError(f"Placeholder template {template!r} must use #1..#n once each, in order")
+    return pieces[0::2]
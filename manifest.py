@@ -0,0 +1,70 @@
+# manifest.py
+# Purpose: Collects, while a module is being converted, the data downstream tools would
+#          otherwise parse out of the generated .lagda.md again: a JSON manifest with
+# 1. the Agda terms (@@AgdaTerm@@ markers) of the prose, with their class and number of
+#    occurrences (recorded by preprocess_lagda as it substitutes the macros);
+# 2. the code block inventory: placeholder, visible/hidden and the lines of each block in the
+#    .lagda file, from \begin{code} to \end{code} (recorded by preprocess_lagda);
+# 3. the headings of the final Markdown, for a search index (recorded by postprocessing
+#    while the lines stream through it).
+# Nothing is re-read or re-parsed: every item is taken from a pass that runs anyway.
+
+import json
+import re
+
+manifest_format_version = 1
+
+heading_pattern = re.compile(r'(#{1,6})[ \t]+(.*?)(?:[ \t]+\{([^{}]*)\})?[ \t]*#*[ \t]*$')
+fence_pattern = re.compile(r'[ \t]*(```|~~~)')
+
+class ModuleManifest:
+    """
+    The manifest of one module.
+    """
+
+    def __init__(self):
+        self.agda_terms = {}  # { (basename, agda_class): occurrences }
+        self.code_blocks = [] # {"placeholder", "hidden", "first_line", "last_line"} in source order
+        self.headings = []    # {"level", "text", "id"} in document order
+
+    def add_agda_term(self, basename, agda_class):
+        key = (basename, agda_class)
+        self.agda_terms[key] = self.agda_terms.get(key, 0) + 1
+
+    def add_code_block(self, placeholder, hidden, first_line, last_line):
+        self.code_blocks.append({"placeholder": placeholder, "hidden": hidden,
+                                 "first_line": first_line, "last_line": last_line})
+
+    def scan_headings(self, lines):
+        """
+        Passes lines (without line breaks) through unchanged, recording the ATX headings
+        among them. Lines inside fenced code blocks are skipped.
+        """
+        fence = None
+        for line in lines:
+            fence_match = fence_pattern.match(line)
+            if fence_match:
+                if fence is None:
+                    fence = fence_match.group(1)
+                elif fence_match.group(1) == fence:
+                    fence = None
+            elif fence is None and line.startswith('#'):
+                heading_match = heading_pattern.match(line)
+                if heading_match:
+                    attributes = (heading_match.group(3) or "").split()
+                    anchors = [attribute[1:] for attribute in attributes if attribute.startswith('#')]
+                    self.headings.append({"level": len(heading_match.group(1)), "text": heading_match.group(2),
+                                          "id": anchors[0] if anchors else None})
+            yield line
+
+    def to_dict(self):
+        return {
+            "version": manifest_format_version,
+            "agda_terms": [{"basename": basename, "agda_class": agda_class, "count": count}
+                           for (basename, agda_class), count in sorted(self.agda_terms.items())],
+            "code_blocks": self.code_blocks,
+            "headings": self.headings,
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
@@ -0,0 +1,150 @@
+# output_writer.py
+# Purpose: Writes output files only when their content changes, and atomically when it does,
+#          so that tools watching the outputs (mkdocs serve, Agda) only see the files that
+#          really changed, and never a half-written one.
+# Actions:
+# 1. Compares the new content with the existing output before anything is written: the whole
+#    content by size and SHA-256 (write_if_changed), or streamed content chunk by chunk as it
+#    comes (ChangedFileWriter, which never holds it in memory as a whole).
+# 2. If they are equal, nothing is created or written next to the output, which keeps its
+#    modification time.
+# 3. Otherwise, from the first difference on, the content goes to a temporary file next to the
+#    output, which is then renamed over it (os.replace is atomic).
+#
+# USAGE:
+#   changed = write_if_changed("Transaction.lagda.md", content)
+# or, for streamed output:
+#   with ChangedFileWriter("Transaction.lagda.md") as f_out:
+#       f_out.writelines(lines)
+#   f_out.changed
+
+import hashlib
+import os
+import uuid
+
+chunk_size = 1024 * 1024
+
+def stream_digest(path, size):
+    """
+    Returns the SHA-256 digest of the file at path, or None if it does not exist or its size
+    differs from size (the content then differs anyway).
+    """
+    try:
+        if os.path.getsize(path) != size:
+            return None
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.digest()
+    except FileNotFoundError:
+        return None
+
+class ChangedFileWriter:
+    """
+    File-like writer (write/writelines of str, encoded as UTF-8, or bytes) that replaces its
+    output on close only if the content differs. Use as a context manager; on an exception the
+    output is left untouched. After closing, .changed tells whether the output was written.
+    While the content written matches the existing output, it is only compared with it; the
+    temporary file is created at the first difference (or at the end, if the new content is
+    shorter), starting with the matching part copied from the existing output.
+    """
+
+    def __init__(self, path, compare=True):
+        """
+        Args:
+            path (str): The output file.
+            compare (bool): If False, the content is taken to differ from the start (e.g., when
+                the caller already compared it).
+        """
+        self.path = path
+        self.changed = False
+        self.file = None      # The temporary file, once the content differs
+        self.temp_path = None
+        self.matched = 0      # Number of bytes written so far that match the existing output
+        self.existing = None  # The existing output, while the content matches it
+        if compare:
+            try:
+                self.existing = open(path, 'rb')
+            except FileNotFoundError:
+                pass
+
+    def start_temp_file(self):
+        # Created with the usual permissions (0666 minus the umask), unlike tempfile.mkstemp
+        self.temp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        fd = os.open(self.temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        self.file = os.fdopen(fd, 'wb')
+        if self.existing is not None:
+            self.existing.seek(0)
+            remaining = self.matched
+            while remaining:
+                block = self.existing.read(min(chunk_size, remaining))
+                self.file.write(block)
+                remaining -= len(block)
+            self.existing.close()
+            self.existing = None
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if self.file is None:
+            if self.existing is not None and self.existing.read(len(data)) == data:
+                self.matched += len(data)
+                return
+            self.start_temp_file()
+        self.file.write(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def close(self):
+        """
+        Moves the new content into place if it differs from the existing output.
+        """
+        if self.file is None:
+            if self.existing is not None and not self.existing.read(1):
+                # Same content and same length: nothing to do
+                self.existing.close()
+                self.existing = None
+                return
+            self.start_temp_file()
+        self.file.close()
+        try:
+            os.replace(self.temp_path, self.path)
+            self.changed = True
+        except BaseException:
+            if os.path.exists(self.temp_path):
+                os.unlink(self.temp_path)
+            raise
+
+    def discard(self):
+        if self.existing is not None:
+            self.existing.close()
+        if self.file is not None:
+            self.file.close()
+            os.unlink(self.temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+def write_if_changed(path, content):
+    """
+    Writes content (str or bytes) to path unless the file already holds exactly that content,
+    which is checked (by size, then SHA-256) before anything is written.
+    Returns:
+        bool: True if the file was written.
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    if stream_digest(path, len(content)) == hashlib.sha256(content).digest():
+        return False
+    with ChangedFileWriter(path, compare=False) as f_out:
+        f_out.write(content)
+    return True
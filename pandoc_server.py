@@ -0,0 +1,142 @@
+# pandoc_server.py
+# Purpose: Runs Pandoc as a long-lived local HTTP server (`pandoc server`), so that converting
+#          a file costs HTTP requests on an open connection instead of starting Pandoc.
+# Actions:
+# 1. start_server launches `pandoc server` (or the separate `pandoc-server` binary) on a
+#    free localhost port and waits until it answers.
+# 2. PandocClient sends conversions to it, keeping one connection open per thread (and per
+#    process: clients are picklable and reconnect after being sent to a worker).
+# The server cannot run Lua filters, so pipeline.run_pandoc_server converts to Pandoc's JSON
+# AST, applies agda_filter.py (the same transformation as agda-filter.lua) and converts the
+# result to Markdown. A client whose server cannot be reached raises ConnectionError and
+# marks itself unavailable; the pipeline then falls back to running Pandoc as a subprocess.
+#
+# USAGE:
+#   process, client = start_server()
+#   markdown = pipeline.convert(source, macro_data, pandoc_server=client)
+#   process.terminate()
+
+import http.client
+import json
+import socket
+import subprocess
+import threading
+import time
+
+# Commands tried in turn to start a server; the port is appended
+server_commands = [["pandoc", "server", "--timeout", "600", "--port"],
+                   ["pandoc-server", "--timeout", "600", "--port"]]
+default_start_timeout = 10.0
+request_timeout = 600
+
+def free_port():
+    """
+    Returns a TCP port on localhost that is currently free.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+class PandocClient:
+    """
+    Client of a `pandoc server` on localhost, safe to use from several threads.
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.available = True
+        self.local = threading.local() # .connection: this thread's HTTPConnection
+
+    def __getstate__(self):
+        # Connections stay with the process (and thread) that opened them
+        return {"port": self.port, "available": self.available}
+
+    def __setstate__(self, state):
+        self.__init__(state["port"])
+        self.available = state["available"]
+
+    def post(self, body):
+        """
+        Sends one request on this thread's connection, reconnecting once if the server
+        closed it in the meantime. Returns (status, response body).
+        """
+        for attempt in range(2):
+            connection = getattr(self.local, "connection", None)
+            try:
+                if connection is None:
+                    connection = self.local.connection = http.client.HTTPConnection(
+                        "127.0.0.1", self.port, timeout=request_timeout)
+                    connection.connect()
+                    # Requests are written in one piece; waiting for ACKs would only add latency
+                    connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                connection.request("POST", "/", body, {"Content-Type": "application/json",
+                                                       "Accept": "application/json"})
+                response = connection.getresponse()
+                return response.status, response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                self.local.connection = None
+                if attempt:
+                    raise
+            except OSError:
+                if connection is not None:
+                    connection.close()
+                self.local.connection = None
+                raise
+
+    def convert(self, text, from_format, to_format):
+        """
+        Converts text from from_format to to_format (Pandoc format names).
+        Returns:
+            str: The output of the conversion.
+        Raises:
+            ConnectionError: If the server cannot be reached (the client is then marked
+                unavailable).
+            RuntimeError: If Pandoc reports an error.
+        """
+        body = json.dumps({"text": text, "from": from_format, "to": to_format}).encode('utf-8')
+        try:
+            status, response = self.post(body)
+        except OSError as e:
+            self.available = False
+            raise ConnectionError(f"pandoc server on port {self.port} unavailable: {e}") from e
+        if status != 200:
+            raise RuntimeError(f"pandoc server failed (HTTP {status}): {response.decode('utf-8', 'replace').strip()}")
+        result = json.loads(response)
+        if "error" in result:
+            raise RuntimeError(f"pandoc server failed: {result['error']}")
+        return result["output"]
+
+def wait_until_ready(port, process, timeout):
+    """
+    Returns True once something accepts connections on port, False if process exits or
+    timeout seconds pass first.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and process.poll() is None:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.02)
+    return False
+
+def start_server(timeout=default_start_timeout):
+    """
+    Starts a Pandoc server on a free localhost port.
+    Returns:
+        tuple: (the server's subprocess.Popen, a PandocClient connected to it).
+    Raises:
+        RuntimeError: If no server could be started (e.g., Pandoc was built without it).
+    """
+    for command in server_commands:
+        port = free_port()
+        try:
+            process = subprocess.Popen([*command, str(port)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except OSError:
+            continue
+        if wait_until_ready(port, process, timeout):
+            return process, PandocClient(port)
+        process.terminate()
+        process.wait()
+    raise RuntimeError("could not start a pandoc server (pandoc server / pandoc-server)")
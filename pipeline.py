@@ -0,0 +1,236 @@
+# pipeline.py
+# Purpose: In-memory API for the whole conversion of one LaTeX-based literate Agda document
+#          (.lagda) into Markdown-based literate Agda (.lagda.md):
+#            preprocess_lagda -> pandoc + filter -> postprocessing
+# With shards > 1, a large document is split at \section/\subsection boundaries and the
+# parts go through Pandoc concurrently (see section_shards.py). Given a pandoc_server.PandocClient,
+# Pandoc runs as a long-lived local server instead of one process per conversion.
+# Nothing is written to disk: Pandoc reads the preprocessed LaTeX from stdin and writes the
+# Markdown to stdout, and the code blocks stay in memory. All state lives in the call (see
+# preprocess.PreprocessState), so convert can be used from several threads at once and from
+# long-running processes.
+#
+# USAGE:
+#   from pipeline import convert
+#   markdown = convert(source, macro_data)    (macro_data: the loaded preprocess_macros.json)
+# or from the command line:
+#   python pipeline.py Transaction.lagda preprocess_macros.json Transaction.lagda.md
+#   python pipeline.py Full.lagda preprocess_macros.json Full.lagda.md --shards 8
+#   python pipeline.py Transaction.lagda preprocess_macros.json Transaction.lagda.md --manifest Transaction.json
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from contextlib import nullcontext
+
+import agda_filter
+import manifest
+import output_writer
+import preprocess
+import postprocess
+import section_shards
+import segment_cache
+
+# --- Configuration ---
+# The Lua filter is looked up next to this script so the pipeline can be run from anywhere.
+lua_filter_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "agda-filter.lua")
+python_filter_file = os.path.abspath(agda_filter.__file__)
+pandoc_args = ["-f", "latex", "-t", "gfm+attributes"]
+filter_engines = ["lua", "python"]
+
+def call_pandoc(args, input_content):
+    """
+    Runs Pandoc with the given arguments, passing input_content on stdin.
+    Returns:
+        str: Pandoc's stdout.
+    Raises:
+        RuntimeError: If Pandoc exits with a non-zero status.
+    """
+    result = subprocess.run(["pandoc", *args], input=input_content, capture_output=True, text=True, encoding="utf-8")
+    if result.returncode != 0:
+        raise RuntimeError(f"pandoc failed (exit {result.returncode}): {result.stderr.strip()}")
+    return result.stdout
+
+def run_pandoc(latex_content):
+    """
+    Runs Pandoc with the Agda Lua filter on the preprocessed LaTeX content.
+    The content is passed on stdin and the Markdown is read back from stdout.
+    Args:
+        latex_content (str): Output of preprocess_lagda.
+    Returns:
+        str: The intermediate Markdown (input for postprocess_markdown).
+    Raises:
+        RuntimeError: If Pandoc exits with a non-zero status.
+    """
+    return call_pandoc([*pandoc_args, "--lua-filter", lua_filter_file], latex_content)
+
+def run_pandoc_python_filter(latex_content, code_blocks):
+    """
+    Like run_pandoc, but filters Pandoc's JSON AST with agda_filter.py in this process,
+    which also puts the code blocks in place of their placeholders.
+    Args:
+        latex_content (str): Output of preprocess_lagda.
+        code_blocks (dict): The code blocks stored by preprocess_lagda.
+    Returns:
+        str: The Markdown, still to go through postprocess_markdown for the admonitions (and any
+             placeholder the filter left nested in another inline).
+    """
+    reader_args, writer_args = pandoc_args[:2], pandoc_args[2:]
+    document = json.loads(call_pandoc([*reader_args, "-t", "json"], latex_content))
+    agda_filter.filter_document(document, code_blocks)
+    return call_pandoc(["-f", "json", *writer_args], json.dumps(document))
+
+def timed_stage(trace, name):
+    """
+    Returns a context manager timing the stage name in trace, if there is a trace.
+    """
+    return trace.stage(name) if trace else nullcontext()
+
+def run_pandoc_server(latex_content, code_blocks, server):
+    """
+    Like run_pandoc_python_filter, but sends both conversions to a Pandoc server.
+    Args:
+        latex_content (str): Output of preprocess_lagda.
+        code_blocks (dict): The code blocks to put in place of their placeholders; with None
+            they are left for postprocess_markdown, as with agda-filter.lua.
+        server (pandoc_server.PandocClient): The server.
+    Raises:
+        ConnectionError: If the server is unavailable.
+    """
+    reader_format, writer_format = pandoc_args[1], pandoc_args[3]
+    document = json.loads(server.convert(latex_content, reader_format, "json"))
+    agda_filter.filter_document(document, code_blocks)
+    return server.convert(json.dumps(document), "json", writer_format)
+
+def run_pipeline(source, macro_data, filter_engine="lua", segments=None, trace=None, shards=1, pandoc_server=None,
+                 manifest=None):
+    """
+    Converts one document, reporting how the segment cache was used.
+    Args:
+        source (str): The content of the .lagda file.
+        macro_data (dict): The loaded preprocess_macros.json (only read; may be shared).
+        filter_engine (str): "lua" (agda-filter.lua) or "python" (agda_filter.py).
+        segments (build_cache.BuildCache): Optional segment cache (see segment_cache.py).
+        trace (instrumentation.Trace): Optional; receives the time and bytes of each stage
+            ("preprocess", "pandoc", "postprocess") and the counts of preprocess_lagda.
+        shards (int): Maximum number of parts of the document converted by concurrent Pandoc
+            processes (see section_shards.py); applies when the whole document is converted.
+        pandoc_server (pandoc_server.PandocClient): Optional Pandoc server to use; while it is
+            unavailable, Pandoc is run as a subprocess.
+        manifest (manifest.ModuleManifest): Optional; filled with the Agda terms, code blocks
+            and headings of the document as they go through the stages.
+    Returns:
+        tuple: (the .lagda.md content, (segment cache hits, segment cache misses, full conversions)).
+    Raises:
+        ValueError: If filter_engine is unknown.
+        RuntimeError: If Pandoc fails.
+    """
+    if filter_engine not in filter_engines:
+        raise ValueError(f"Unknown filter engine {filter_engine!r} (expected one of {filter_engines})")
+    state = preprocess.PreprocessState(macro_data, trace, manifest)
+    with timed_stage(trace, "preprocess"):
+        latex_content = preprocess.preprocess_lagda(source, state)
+
+    if filter_engine == "python":
+        def convert_document(content):
+            return run_pandoc_python_filter(content, state.code_blocks_data)
+    else:
+        convert_document = run_pandoc
+    if pandoc_server:
+        run_subprocess = convert_document
+        # The code blocks are only inserted by the filter with the Python engine
+        filter_code_blocks = state.code_blocks_data if filter_engine == "python" else None
+        def convert_document(content):
+            if pandoc_server.available:
+                try:
+                    return run_pandoc_server(content, filter_code_blocks, pandoc_server)
+                except ConnectionError:
+                    pass
+            return run_subprocess(content)
+    shard_counts = []
+    def convert_latex(content):
+        markdown, shard_count = section_shards.convert_sharded(content, shards, convert_document)
+        shard_counts.append(shard_count)
+        return markdown
+    segment_stats = (0, 0, 0)
+    with timed_stage(trace, "pandoc"):
+        if segments:
+            intermediate_content, segment_stats = segment_cache.convert_segmented(latex_content, segments, convert_latex)
+        else:
+            intermediate_content = convert_latex(latex_content)
+
+    with timed_stage(trace, "postprocess"):
+        # With the Python engine most code blocks are already in place; the placeholder pass
+        # still replaces those the filter leaves as text (nested in emphasis, links, spans...)
+        final_content = postprocess.postprocess_markdown(intermediate_content, state.code_blocks_data, manifest)
+
+    if trace:
+        trace.add_bytes("preprocess", source, latex_content)
+        trace.add_bytes("pandoc", latex_content, intermediate_content)
+        trace.add_bytes("postprocess", intermediate_content, final_content)
+        for name, count in zip(("segment_hits", "segment_misses", "segment_full_conversions"), segment_stats):
+            trace.count(name, count)
+        trace.count("pandoc_shards", sum(shard_counts))
+    return final_content, segment_stats
+
+def convert(source, macro_data, filter_engine="lua", segments=None, trace=None, shards=1, pandoc_server=None,
+            manifest=None):
+    """
+    Converts the content of a .lagda file into the content of the .lagda.md file.
+    Safe to call concurrently: every call has its own state.
+    Args:
+        source (str): The content of the .lagda file.
+        macro_data (dict): The loaded preprocess_macros.json (only read; may be shared).
+        filter_engine (str): "lua" (agda-filter.lua) or "python" (agda_filter.py).
+        segments (build_cache.BuildCache): Optional segment cache (see segment_cache.py).
+        trace (instrumentation.Trace): Optional; receives the measurements of the run.
+        shards (int): Maximum number of concurrent Pandoc processes for this document.
+        pandoc_server (pandoc_server.PandocClient): Optional Pandoc server to use.
+        manifest (manifest.ModuleManifest): Optional; receives the module manifest.
+    Returns:
+        str: The Markdown-based literate Agda content.
+    """
+    return run_pipeline(source, macro_data, filter_engine, segments, trace, shards, pandoc_server, manifest)[0]
+
+# --- Script Entry Point ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert one .lagda file to .lagda.md.")
+    parser.add_argument("input_lagda", help="the .lagda file")
+    parser.add_argument("macros_json", help="macro definitions generated by generate_macros_json.py")
+    parser.add_argument("output_lagda_md", help="the .lagda.md file to write")
+    parser.add_argument("--filter-engine", choices=filter_engines, default="lua",
+                        help="agda-filter.lua, or agda_filter.py on Pandoc's JSON AST (default: lua)")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="split the document at sections and run up to this many Pandoc processes at once")
+    parser.add_argument("--manifest", metavar="FILE",
+                        help="also write the module manifest (Agda terms, code blocks, headings) as JSON")
+    args = parser.parse_args()
+
+    input_lagda_file, input_json_file, output_lagda_md_file = args.input_lagda, args.macros_json, args.output_lagda_md
+
+    try:
+        with open(input_json_file, 'r', encoding='utf-8') as f_json:
+            macro_data = json.load(f_json)
+        with open(input_lagda_file, 'r', encoding='utf-8') as f_lagda:
+            source = f_lagda.read()
+        module_manifest = manifest.ModuleManifest() if args.manifest else None
+        final_content = convert(source, macro_data, args.filter_engine, shards=args.shards, manifest=module_manifest)
+        changed = output_writer.write_if_changed(output_lagda_md_file, final_content)
+        if module_manifest:
+            output_writer.write_if_changed(args.manifest, module_manifest.to_json())
+        if changed:
+            print(f"Successfully generated {output_lagda_md_file}")
+        else:
+            print(f"{output_lagda_md_file} is up to date (not rewritten)")
+
+    except FileNotFoundError as e:
+        print(f"Error: Input file not found: {e.filename}", file=sys.stderr)
+        sys.exit(1)
+    except json.JSONDecodeError as e:
+        print(f"Error: Failed to parse JSON file {input_json_file}: {e}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"An error occurred: {e}", file=sys.stderr)
+        sys.exit(1)
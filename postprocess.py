@@ -1,17 +1,28 @@
 # postprocess.py
 # Purpose: Cleans up the intermediate Markdown file generated by Pandoc+Lua filter.
 # Actions:
-# 1. Replaces code block placeholders (@@CODEBLOCK_ID_n@@) with actual verbatim code,
+# 1. Replaces code block placeholders (@@CODEBLOCK_ID_<hash>@@) with actual verbatim code,
 #    wrapping visible code in expanded admonitions (!!! note) and hidden code
-#    in collapsible admonitions (??? note). Handles necessary indentation.
+#    in collapsible admonitions (??? note). Handles necessary indentation. The code is read from
+#    code_blocks.json or, zero-copy, from the source file through a code block index (code_block_index.py).
 # 2. Replaces admonition markers (@@ADMONITION_START/END@@) with MkDocs admonition syntax (??? note)
-#    and indents the content within the admonition block.
+#    and indents the content within the admonition block (nested admonitions are indented further).
+# Both steps are done in a single pass over the lines of the input, and the output is written
+# as it is produced, so memory use does not grow with the size of the input. An output file whose
+# content would not change is left untouched (see output_writer.py). The same pass can
+# record the headings for a module manifest (see manifest.py).
 
 import re
 import json
 import sys
 import io # Used for robust line processing
 
+from code_block_index import CodeBlockIndex, is_index_file
+from output_writer import ChangedFileWriter
+
+# Code block placeholders as written by preprocess.process_code_block
+code_placeholder_pattern = re.compile(r'@@CODEBLOCK_ID_[0-9a-f]+@@')
+
 # Helper function to indent a block of text consistently
 def indent_block(text, prefix="    "):
     lines = text.split('\n')
@@ -21,16 +32,26 @@ def indent_block(text, prefix="    "):
 # Code block replacer function used by re.sub
 def replace_code_placeholder(match, code_blocks):
     """
-    Callback function for re.sub to replace code placeholder IDs (@@CODEBLOCK_ID_n@@).
-    Retrieves code from the code_blocks dict and formats it either
-    as a visible code block (!!! note admonition) or a hidden one (??? note admonition).
+    Callback function for re.sub to replace code placeholder IDs (@@CODEBLOCK_ID_<hash>@@).
     Args:
         match (re.Match): The regex match object for the placeholder ID.
         code_blocks (dict): The dictionary loaded from code_blocks.json.
     Returns:
         str: The formatted Markdown string for the code block/admonition.
     """
-    placeholder_id = match.group(0) # The full placeholder string, e.g., "@@CODEBLOCK_ID_1@@"
+    return format_code_block(match.group(0), code_blocks)
+
+def format_code_block(placeholder_id, code_blocks):
+    """
+    Retrieves code from the code_blocks dict and formats it either
+    as a visible code block (!!! note admonition) or a hidden one (??? note admonition).
+    Args:
+        placeholder_id (str): The full placeholder string, e.g., "@@CODEBLOCK_ID_3f2a9c0d1e4b5a67@@".
+        code_blocks (dict): The dictionary loaded from code_blocks.json.
+    Returns:
+        str: The formatted Markdown string for the code block/admonition
+             (the placeholder itself if the code block is unknown).
+    """
     block_data = code_blocks.get(placeholder_id)
 
     # Safety check if ID not found in the JSON data
@@ -69,57 +90,101 @@ def replace_code_placeholder(match, code_blocks):
         replacement_str = f'\n!!! note\n\n    ```agda\n{indented_code_content}    ```\n' # Note final ``` is indented
         return replacement_str
 
-# Function to process Conway admonition markers and indent content
-def process_conway_admonitions(content):
+# Regex to find the START marker at the beginning of a line (after optional whitespace)
+# Captures Title (Group 1). Matches literal \| escaped by Pandoc.
+admonition_start_pattern = re.compile(r'^\s*@@ADMONITION_START\\\|(.*?)\s*@@\s*$')
+# Regex to find the END marker (must be alone on line after optional whitespace)
+admonition_end_pattern = re.compile(r'^\s*@@ADMONITION_END@@\s*$')
+indent_prefix = "    " # Standard 4 spaces for admonition content
+
+# Generator formatting admonitions line by line
+def format_admonition_lines(lines):
     """
     Finds Conway admonition markers (@@ADMONITION_START/END@@),
-    converts the start marker to MkDocs admonition syntax (??? note),
-    removes the end marker, and indents all content lines between the markers.
+    converts each start marker to MkDocs admonition syntax (??? note),
+    removes the end markers, and indents the content lines between the markers.
+    Admonitions may be nested: each open admonition adds one level of indentation.
     Args:
-        content (str): The Markdown content (string) after code blocks have been inserted.
-    Returns:
-        str: The processed Markdown content with admonitions formatted.
+        lines (iterable[str]): The Markdown lines (without line breaks) after code blocks have been inserted.
+    Yields:
+        str: The output, one line (with its line break) at a time.
     """
-    output_lines = []
-    is_indenting_admonition = False # State flag: are we inside a Conway admonition?
-    indent_prefix = "    " # Standard 4 spaces for admonition content
-
-    # Regex to find the START marker at the beginning of a line (after optional whitespace)
-    # Captures Title (Group 1). Matches literal \| escaped by Pandoc.
-    admonition_start_pattern = re.compile(r'^\s*@@ADMONITION_START\\\|(.*?)\s*@@\s*$')
-    # Regex to find the END marker (must be alone on line after optional whitespace)
-    admonition_end_pattern = re.compile(r'^\s*@@ADMONITION_END@@\s*$')
-
-    # print("\nDEBUG: Starting process_conway_admonitions...", file=sys.stderr)
-    for i, line in enumerate(content.splitlines()):
+    depth = 0 # Number of open admonitions
+    for line in lines:
         line_stripped = line.strip()
-
-        # Use repr() for debugging if needed again
-        # print(f"DEBUG: Line {i+1} (stripped): {repr(line_stripped)}", file=sys.stderr)
-
         start_match = admonition_start_pattern.match(line_stripped)
-        end_match = admonition_end_pattern.match(line_stripped)
 
         if start_match:
-            # Found the start marker
+            # Found a start marker: its heading is indented like the content around it
             title = start_match.group(1).strip() if start_match.group(1) else "Conway specifics"
-            # print(f"DEBUG: Found START marker on line {i+1}. Title='{title}'", file=sys.stderr) # DEBUG
-            output_lines.append(f'\n??? note "{title}"\n')
-            is_indenting_admonition = True
-        elif end_match and is_indenting_admonition:
-             # print(f"DEBUG: Found END marker on line {i+1}.", file=sys.stderr) # DEBUG
-             is_indenting_admonition = False
-        elif is_indenting_admonition:
-            # Indent content lines (same as before)
-            if line.strip() or line.isspace():
-                 output_lines.append(indent_prefix + line)
-            else:
-                 output_lines.append(line)
+            yield f'\n{indent_prefix * depth}??? note "{title}"\n\n'
+            depth += 1
+        elif depth and admonition_end_pattern.match(line_stripped):
+            depth -= 1
+        elif depth and line:
+            # Indent content lines (whitespace-only ones too, but not empty ones)
+            yield indent_prefix * depth + line + "\n"
         else:
-            output_lines.append(line)
+            yield line + "\n"
+
+# Function to process Conway admonition markers and indent content
+def process_conway_admonitions(content, manifest=None):
+    """
+    Formats the Conway admonitions of a whole document (see format_admonition_lines).
+    Args:
+        content (str): The Markdown content (string) after code blocks have been inserted.
+        manifest (manifest.ModuleManifest): Optional; receives the headings.
+    Returns:
+        str: The processed Markdown content with admonitions formatted.
+    """
+    lines = content.splitlines()
+    if manifest:
+        lines = manifest.scan_headings(lines)
+    return ''.join(format_admonition_lines(lines)) or "\n"
 
-    # print("DEBUG: Finished process_conway_admonitions.", file=sys.stderr) # DEBUG
-    return "\n".join(output_lines) + "\n"
+# Generator running both post-processing steps in a single pass
+def postprocess_lines(intermediate_lines, code_blocks, manifest=None):
+    """
+    Applies all post-processing steps line by line: code block placeholders are replaced,
+    then the resulting lines go through format_admonition_lines. Only one input line (and
+    the code blocks it refers to) is held in memory at a time.
+    Args:
+        intermediate_lines (iterable[str]): Lines of the Markdown produced by Pandoc+Lua filter
+            (e.g., an open file).
+        code_blocks (dict): The dictionary loaded from code_blocks.json.
+        manifest (manifest.ModuleManifest): Optional; receives the headings.
+    Yields:
+        str: The final Markdown, one line (with its line break) at a time.
+    """
+    def expanded_lines():
+        for line in intermediate_lines:
+            if '@@CODEBLOCK_ID_' in line:
+                line = code_placeholder_pattern.sub(lambda m: replace_code_placeholder(m, code_blocks), line)
+            yield from line.splitlines()
+
+    lines = expanded_lines()
+    if manifest:
+        lines = manifest.scan_headings(lines)
+    empty = True
+    for output_line in format_admonition_lines(lines):
+        empty = False
+        yield output_line
+    if empty:
+        yield "\n"
+
+# Main post-processing function (both steps, in order)
+def postprocess_markdown(intermediate_content, code_blocks, manifest=None):
+    """
+    Applies all post-processing steps to the intermediate Markdown content:
+    code block placeholders are replaced first, then Conway admonitions are formatted.
+    Args:
+        intermediate_content (str): The Markdown produced by Pandoc+Lua filter.
+        code_blocks (dict): The dictionary loaded from code_blocks.json.
+        manifest (manifest.ModuleManifest): Optional; receives the headings.
+    Returns:
+        str: The final Markdown content.
+    """
+    return ''.join(postprocess_lines(io.StringIO(intermediate_content), code_blocks, manifest))
 
 
 # --- Script Entry Point ---
@@ -132,31 +197,31 @@ if __name__ == "__main__":
     input_md_file, input_code_blocks_file, output_lagda_md_file = sys.argv[1], sys.argv[2], sys.argv[3]
 
     try:
-        # Load code block data from JSON
+        # Load code block data from JSON, or open the code block index (the code is then read
+        # from a memory map of the source file, see code_block_index.py)
         print(f"Loading code blocks from {input_code_blocks_file}", file=sys.stderr)
-        with open(input_code_blocks_file, 'r', encoding='utf-8') as f_code: code_blocks = json.load(f_code)
+        if is_index_file(input_code_blocks_file):
+            code_blocks = CodeBlockIndex(input_code_blocks_file)
+        else:
+            with open(input_code_blocks_file, 'r', encoding='utf-8') as f_code: code_blocks = json.load(f_code)
         print(f"Loaded {len(code_blocks)} code blocks.", file=sys.stderr)
 
-        # Read intermediate markdown file generated by Pandoc+Lua
-        print(f"Reading intermediate MD from {input_md_file}", file=sys.stderr)
-        with open(input_md_file, 'r', encoding='utf-8') as f_md: intermediate_content = f_md.read()
-        print(f"Read {len(intermediate_content)} chars from intermediate file.", file=sys.stderr)
-
-
-        # Step 1: Replace code block placeholders (@@CODEBLOCK_ID_n@@)
-        print(f"Replacing code block placeholders...", file=sys.stderr)
-        content_with_code = re.sub(r'@@CODEBLOCK_ID_\d+@@', lambda m: replace_code_placeholder(m, code_blocks), intermediate_content)
-
+        # Stream the intermediate markdown file generated by Pandoc+Lua to the final file:
+        # Step 1: Replace code block placeholders (@@CODEBLOCK_ID_<hash>@@)
         # Step 2: Process Conway admonition markers (@@ADMONITION_...@@) and indent content
-        print(f"Processing Conway admonitions...", file=sys.stderr)
-        final_content = process_conway_admonitions(content_with_code)
-
-        # Write the fully processed final Markdown file
+        print(f"Replacing code block placeholders and processing Conway admonitions in {input_md_file}...", file=sys.stderr)
         print(f"Writing final output to {output_lagda_md_file}", file=sys.stderr)
-        with open(output_lagda_md_file, 'w', encoding='utf-8') as f_out: f_out.write(final_content)
+        with open(input_md_file, 'r', encoding='utf-8') as f_md, \
+             ChangedFileWriter(output_lagda_md_file) as f_out:
+            f_out.writelines(postprocess_lines(f_md, code_blocks))
+        if isinstance(code_blocks, CodeBlockIndex):
+            code_blocks.close()
 
         # Final success message (to stdout for potential scripting)
-        print(f"Successfully generated {output_lagda_md_file}")
+        if f_out.changed:
+            print(f"Successfully generated {output_lagda_md_file}")
+        else:
+            print(f"{output_lagda_md_file} is up to date (not rewritten)")
 
     except FileNotFoundError as e:
         print(f"Error: Input file not found: {e.filename}", file=sys.stderr)
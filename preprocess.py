@@ -1,64 +1,111 @@
 # preprocess.py
 # Purpose: Prepares a LaTeX-based literate Agda file (.lagda) for Pandoc processing.
 # Actions:
-# 1. Replaces Agda code blocks (\begin{code} / \begin{code}[hide]) with unique placeholders (@@CODEBLOCK_ID_n@@).
-# 2. Stores the verbatim content of each code block, along with its hidden status, in a JSON file.
+# 1. Replaces Agda code blocks (\begin{code} / \begin{code}[hide]) with placeholders derived from a hash of
+#    their content (@@CODEBLOCK_ID_<hash>@@), so that editing one block leaves the others' placeholders unchanged.
+# 2. Stores the verbatim content of each code block, along with its hidden status, in a JSON file;
+#    or, if the output file name ends in .idx, only the byte offsets of each block in the input file
+#    (see code_block_index.py).
 # 3. Inlines \modulenote macros into LaTeX \href commands.
 # 4. Replaces specific Agda term macros (from macros.json) with \texttt{@@AgdaTerm@@...} markers.
-# 5. Replaces \hldiff macros with \HighlightPlaceholder markers.
+# 5. Replaces \hldiff macros with \HighlightPlaceholder markers (and other placeholder macros from macros.json
+#    with their templates).
 # 6. Removes \begin{figure*}/\end{figure*} environment wrappers.
 # 7. Removes \begin{AgdaMultiCode}/\end{AgdaMultiCode} environment wrappers.
 # 8. Removes \begin{NoConway}/\end{NoConway} environment wrappers (content flows).
 # 9. Replaces \begin{Conway}/\end{Conway} environment wrappers with admonition markers (@@ADMONITION_START/END@@).
+# All of the above is done in a single left-to-right scan of the input (see preprocess_lagda).
+# With --stream, the input is read and processed in chunks of about stream_chunk_size characters
+# (see preprocess_lagda_stream), so that the memory used stays the same however large the input
+# (e.g., the concatenation of all modules for the monolithic build).
 # Output:
 # - Prints processed LaTeX content (with placeholders) to stdout.
-# - Writes code block data to a specified JSON file.
+# - Writes code block data to a specified JSON file (left untouched if its content would not
+#   change, see output_writer.py).
 
 import re
 import json
 import sys
 import os
+import hashlib
+import time
+
+import code_block_index
+from macro_matcher import MacroTrie, split_template
+from output_writer import ChangedFileWriter
 
 # --- Configuration ---
 repo_url = "https://github.com/IntersectMBO/formal-ledger-specifications"
 repo_src_base = "blob/master/src/Ledger"
+# Number of hex digits of the SHA-256 content hash used in code block placeholders
+code_block_hash_length = 16
+# Macros with arguments that are always available; the "placeholders" section of the
+# macro JSON can add to or override them. #1..#n stand for the (brace-delimited) arguments.
+default_placeholders = {
+    "hldiff": "\\HighlightPlaceholder{#1}",
+}
+# Size in characters from which preprocess_lagda_stream cuts the input at the next safe line
+stream_chunk_size = 64 * 1024
+# A chunk that grows to this many times stream_chunk_size without a place to cut it is reported
+stream_chunk_warning_factor = 16
+
+# --- Per-Call State ---
+class PreprocessState:
+    """
+    Everything preprocess_lagda reads and produces for one document. Each call gets its own
+    state, so documents can be preprocessed concurrently (e.g., from several threads).
+    """
 
-# --- Global Storage ---
-# Stores { "placeholder_id": {"content": "...", "hidden": True/False} }
-code_blocks_data = {}
-code_block_counter = 0
-# Stores macro definitions loaded from JSON file { "macroName": {"basename": "...", "agda_class": "..."} }
-macro_data = {}
+    def __init__(self, macro_data, trace=None, manifest=None):
+        """
+        Args:
+            macro_data (dict): Macro definitions loaded from the JSON file
+                { "agda_terms": { "macroName": {"basename": "...", "agda_class": "..."} }, ... }.
+                It is only read, so one table can be shared by all calls.
+            trace (instrumentation.Trace): Optional; receives the time spent on each kind of
+                construct, substitution counts and unknown macros.
+            manifest (manifest.ModuleManifest): Optional; receives the Agda terms substituted
+                and the code block inventory.
+        """
+        self.macro_data = macro_data
+        self.trace = trace
+        self.manifest = manifest
+        # Stores { "placeholder_id": {"content": "...", "hidden": True/False} }
+        self.code_blocks_data = {}
+        # Stores { "placeholder_id": (start, end, hidden) }: where each code block is in the input, in characters
+        self.code_block_spans = {}
 
 # --- Replacement Functions ---
 
-def process_code_block(match, is_hidden):
+def process_code_block(state, original_code, is_hidden, span=None):
     """
-    Callback function for re.sub to process matched code blocks.
-    Stores the verbatim code content in the global dictionary and returns a unique placeholder ID.
+    Stores the verbatim code content of a code block in state.code_blocks_data
+    and returns a placeholder ID derived from its content.
+    The ID depends only on the block itself (not on its position), so inserting or editing
+    one block does not change the placeholders of the others. Identical blocks share an ID.
     Args:
-        match (re.Match): The regex match object. Group 1 contains the code content.
+        state (PreprocessState): The state of the current call.
+        original_code (str): The text between \\begin{code}[hide] (or \\begin{code}) and \\end{code}.
         is_hidden (bool): True if the block was marked with [hide].
+        span (tuple): Optional (start, end) of original_code in the input, stored in state.code_block_spans.
     Returns:
-        str: The placeholder ID (e.g., "@@CODEBLOCK_ID_1@@").
+        str: The placeholder ID (e.g., "@@CODEBLOCK_ID_3f2a9c0d1e4b5a67@@").
     """
-    global code_block_counter, code_blocks_data
-    # Extract content between the \begin{code...} and \end{code}
-    # Group 1 should capture the content due to (.*?)
-    original_code = match.group(1)
-    code_block_counter += 1
-    placeholder_id = f"@@CODEBLOCK_ID_{code_block_counter}@@"
-
     # Safety check for potentially empty captures
     if original_code is None: original_code = ""
     # Ensure content ends with a newline for consistent handling later
     if not original_code.endswith('\n'):
         original_code += '\n'
 
-    code_blocks_data[placeholder_id] = {
+    kind = "hidden" if is_hidden else "visible"
+    digest = hashlib.sha256(f"{kind}\0{original_code}".encode('utf-8'))
+    placeholder_id = f"@@CODEBLOCK_ID_{digest.hexdigest()[:code_block_hash_length]}@@"
+    state.code_blocks_data[placeholder_id] = {
         "content": original_code,
         "hidden": is_hidden
     }
+    if span is not None:
+        state.code_block_spans[placeholder_id] = (*span, is_hidden)
     # Return ONLY the placeholder to replace the entire \begin{code}...\end{code} block
     return placeholder_id
 
@@ -82,115 +129,558 @@ def replace_modulenote_direct(match):
     # Reconstruct the sentence based on original \modulenote definition
     return f"This section is part of the {module_link} module of the {repo_link}"
 
-def expand_agda_term_placeholder(match):
+def agda_term_info(macro_data, macro_name):
+    """
+    Returns (basename, agda_class) of a known Agda term macro, or None if it is not in the JSON.
+    """
+    term_info = macro_data.get("agda_terms", {}).get(macro_name)
+    if term_info and isinstance(term_info, dict):
+        # Default to the macro name itself, and to AgdaUnknown if the class is missing
+        return term_info.get("basename", macro_name), term_info.get("agda_class", "AgdaUnknown")
+    return None
+
+def expand_agda_term_placeholder(macro_data, macro_name, trace=None):
     """
-    Callback function for re.sub to replace known Agda term macros (e.g., \txins{})
-    with a \texttt enclosed marker containing semantic info from the loaded JSON.
+    Replaces a known Agda term macro (e.g., \txins{}) with a \texttt enclosed marker
+    containing semantic info from the loaded JSON.
     Example output: \texttt{@@AgdaTerm@@basename=txins@@class=AgdaField@@}
     Args:
-        match (re.Match): The regex match object. Group 1 contains the macro name (e.g., "txins").
+        macro_data (dict): The macro definitions loaded from the JSON file.
+        macro_name (str): The macro name (e.g., "txins").
+        trace (instrumentation.Trace): Optional; macros not found are recorded there
+            instead of being reported one by one.
     Returns:
         str: The \texttt enclosed marker string, or the original macro if not found in JSON.
     """
-    global macro_data
-    macro_name = match.group(1)
-    term_info = macro_data.get("agda_terms", {}).get(macro_name)
+    term_info = agda_term_info(macro_data, macro_name)
 
-    if term_info and isinstance(term_info, dict):
-        basename = term_info.get("basename", macro_name) # Default to macro name itself
-        agda_class = term_info.get("agda_class", "AgdaUnknown") # Default if class missing
+    if term_info:
+        basename, agda_class = term_info
         # Format with distinctive markers for Lua filter to find within \texttt -> Code element
         return f"\\texttt{{@@AgdaTerm@@basename={basename}@@class={agda_class}@@}}"
     else:
         # If macro definition wasn't found in JSON, return the original text
-        print(f"Debug: Macro {macro_name} not found in JSON, keeping original.", file=sys.stderr)
-        return match.group(0)
+        if trace:
+            trace.unknown_macro(macro_name)
+        else:
+            print(f"Debug: Macro {macro_name} not found in JSON, keeping original.", file=sys.stderr)
+        return f"\\{macro_name}{{}}"
+
+# --- Scanner Tables ---
+# Environment wrappers handled at the start of a line. Each entry maps (begin|end, name) to the
+# pattern that must follow the \begin{name}/\end{name} token and the text that replaces the line.
+environment_marker_list = {
+    ("begin", "figure*"): (re.compile(r'(\[[^\]]*\])?\s*?\n'), ''),
+    ("end", "figure*"): (re.compile(r'\s*?\n?'), ''),
+    ("begin", "AgdaMultiCode"): (re.compile(r'\s*?\n'), ''),
+    ("end", "AgdaMultiCode"): (re.compile(r'\s*?\n?'), ''),
+    ("begin", "NoConway"): (re.compile(r'\s*?\n'), ''),
+    ("end", "NoConway"): (re.compile(r'\s*?\n?'), ''),
+    ("begin", "Conway"): (re.compile(r'\s*?\n'), '\n\n@@ADMONITION_START|Conway specifics@@\n\n'),
+    ("end", "Conway"): (re.compile(r'\s*?\n?'), '\n\n@@ADMONITION_END@@\n\n'),
+}
+# The rank of each entry (its position in the table above) is used to resolve wrapper lines
+# that share a line, see preprocess_lagda.
+environment_markers = {key: (rank, *value) for rank, (key, value) in enumerate(environment_marker_list.items())}
+code_hide_pattern = re.compile(r'\s*\[hide\]')
+modulenote_pattern = re.compile(r'\\modulenote\{\s*\\LedgerModule\{(.*?)\}\s*\}')
+# The beginnings of a \modulenote that the lines after them may complete (only whitespace can span lines)
+modulenote_prefix_pattern = re.compile(r'\\modulenote\{\s*(?:\\LedgerModule\{.*?\}\s*)?\Z')
+
+# Every construct handled by preprocess_lagda starts with one of these tokens; the text
+# between two tokens is copied through unchanged. Control words (e.g. \txins) are looked up
+# in the macro trie. Inside the arguments of a placeholder macro, braces are tokens too, so
+# that the argument can be matched up with its closing brace; \\, \{ and \} are skipped.
+token_pattern = re.compile(r'\\begin\{code\}'
+                           r'|\\(?:begin|end)\{(?:figure\*|AgdaMultiCode|NoConway|Conway)\}'
+                           r'|\\modulenote\{'
+                           r'|\\[A-Za-z@]|\\.')
+argument_token_pattern = re.compile(token_pattern.pattern + r'|[{}]', re.DOTALL)
+control_word_pattern = re.compile(r'[A-Za-z@]+')
 
-def expand_hldiff(match):
+def construct_of(token):
     """
-    Callback function for re.sub to replace hldiff{content} with a placeholder
-    that the Lua filter can convert to a styled span.
-    Args:
-        match (re.Match): The regex match object. Group 1 contains the content.
-    Returns:
-        str: The HighlightPlaceholder marker string.
+    Returns the name under which the time spent on a token is traced (see preprocess_lagda).
     """
-    content = match.group(1)
-    # Using a simple placeholder command that Pandoc's LaTeX reader should pass through
-    return f"\\HighlightPlaceholder{{{content}}}"
+    if token == '\\begin{code}':
+        return "code_blocks"
+    if token.startswith('\\begin{') or token.startswith('\\end{'):
+        return "environments"
+    if token == '\\modulenote{':
+        return "modulenotes"
+    if token in ('{', '}'):
+        return "placeholder_arguments"
+    return "macros"
+
+# The trie compiled for the most recently used macro table: (macro table, trie).
+# It is only ever replaced as a whole, so concurrent callers always see a matching pair
+# (at worst, two threads both compile the trie for a new table).
+macro_matcher_cache = (None, None)
+
+def get_macro_matcher(macro_table):
+    """
+    Returns the macro trie for the given macro table (as loaded from the JSON file),
+    compiling it only once: the trie is reused as long as the same table object is passed in.
+    Agda terms map to ("agda_term", None) and placeholders to ("placeholder", pieces).
+    """
+    global macro_matcher_cache
+    cached_table, matcher = macro_matcher_cache
+    if cached_table is not macro_table:
+        matcher = MacroTrie()
+        for name in macro_table.get("agda_terms") or {}:
+            matcher.add(name, ("agda_term", None))
+        placeholders = dict(default_placeholders)
+        placeholders.update(macro_table.get("placeholders") or {})
+        for name, template in placeholders.items():
+            matcher.add(name, ("placeholder", split_template(template)))
+        macro_matcher_cache = (macro_table, matcher)
+    return matcher
 
 # --- Main Processing Function ---
-def preprocess_lagda(content):
+def preprocess_lagda(content, state):
     """
-    Applies all preprocessing replacements to the input LaTeX content.
+    Applies all preprocessing replacements to the input LaTeX content in a single
+    left-to-right scan (linear in the size of the input):
+      - \\begin{code}[hide] ... \\end{code} and \\begin{code} ... \\end{code} become
+        @@CODEBLOCK_ID_<hash>@@ placeholders (hidden blocks are stored before visible ones).
+        A block ends at the first \\end{code}, so an unterminated \\begin{code} takes in the
+        next block (the earlier hidden-first pass took that block on its own if it was hidden);
+      - \\modulenote{\\LedgerModule{...}} is expanded;
+      - known Agda term macros become \\texttt{@@AgdaTerm@@...} markers;
+      - placeholder macros such as \\hldiff{...} become their templates (here
+        \\HighlightPlaceholder{...}), matching balanced braces;
+      - figure*, AgdaMultiCode and NoConway wrapper lines are removed and Conway wrapper
+        lines become admonition markers. Like the ^\\s* anchored patterns they replace, a
+        wrapper line also swallows the whitespace-only lines directly above it.
+    If state has a trace, the time spent is traced per kind of construct as
+    "preprocess/<construct>" ("preprocess/scan" is the search for the next token), along with
+    the number of substitutions of each kind and the unknown macros.
     Args:
         content (str): The original content of the .lagda file.
+        state (PreprocessState): Holds the macro table; receives the code blocks.
     Returns:
         str: The processed LaTeX content with placeholders.
     """
-    global macro_data # Ensure loaded macro data is accessible
-
-    # Order of operations matters here. Code blocks are replaced first.
-
-    # 1. Replace code blocks with placeholders (@@CODEBLOCK_ID_n@@) and store content
-    # Process hidden blocks first to ensure the [hide] variant is matched correctly
-    content = re.sub(r'\\begin\{code\}\s*\[hide\](.*?)\\end\{code\}',
-                     lambda m: process_code_block(m, is_hidden=True),
-                     content, flags=re.DOTALL)
-    # Process remaining visible blocks
-    content = re.sub(r'\\begin\{code\}(.*?)\\end\{code\}',
-                     lambda m: process_code_block(m, is_hidden=False),
-                     content, flags=re.DOTALL)
-
-    # 2. Inline \modulenote
-    # Uses specific regex to match the known structure with \LedgerModule inside
-    content = re.sub(r'\\modulenote\{\s*\\LedgerModule\{(.*?)\}\s*\}',
-                     replace_modulenote_direct,
-                     content)
-
-    # 3. Replace Agda term macros with \texttt{@@AgdaTerm@@...} placeholders
-    if macro_data.get("agda_terms"):
-      # Build a regex pattern matching any known Agda term macro (keys from JSON) followed by {}
-      agda_term_pattern = r'\\(' + '|'.join(re.escape(k) for k in macro_data["agda_terms"].keys()) + r')\{\}'
-      content = re.sub(agda_term_pattern, expand_agda_term_placeholder, content)
-
-    # 4. Replace \hldiff with \HighlightPlaceholder
-    # Use non-greedy match for content and DOTALL flag for potential multiline content
-    content = re.sub(r'\\hldiff\{(.*?)\}', expand_hldiff, content, flags=re.DOTALL)
-
-    # 5. Remove figure* environment wrappers (matching start/end lines)
-    content = re.sub(r'^\s*\\begin\{figure\*}(\[[^\]]*\])?\s*?\n', '', content, flags=re.MULTILINE)
-    content = re.sub(r'^\s*\\end\{figure\*\}\s*?\n?', '', content, flags=re.MULTILINE)
-
-    # 6. Remove AgdaMultiCode environment wrappers (matching start/end lines)
-    content = re.sub(r'^\s*\\begin\{AgdaMultiCode\}\s*?\n', '', content, flags=re.MULTILINE)
-    content = re.sub(r'^\s*\\end\{AgdaMultiCode\}\s*?\n?', '', content, flags=re.MULTILINE)
-
-    # 7. Handle Conway/NoConway environments
-    # Remove NoConway wrappers entirely
-    content = re.sub(r'^\s*\\begin\{NoConway\}\s*?\n', '', content, flags=re.MULTILINE)
-    content = re.sub(r'^\s*\\end\{NoConway\}\s*?\n?', '', content, flags=re.MULTILINE)
-    # Replace Conway wrappers with Admonition markers, ensuring separation with newlines
-    content = re.sub(r'^\s*\\begin\{Conway\}\s*?\n', '\n\n@@ADMONITION_START|Conway specifics@@\n\n', content, flags=re.MULTILINE)
-    content = re.sub(r'^\s*\\end\{Conway\}\s*?\n?', '\n\n@@ADMONITION_END@@\n\n', content, flags=re.MULTILINE)
-
-    return content
+    matcher = get_macro_matcher(state.macro_data)
+    trace = state.trace
+    manifest = state.manifest
+
+    out = []            # Output pieces, joined at the end
+    # Wrapper lines swallow the whitespace before them back to a line start. The earlier
+    # sequential passes are reproduced with a stack of the boundaries that such a line start
+    # can be searched back to: (kind, rank, index into out, ended with newline). "start" is the
+    # start of the input, "text" any other output and "removed"/"replaced" a wrapper line
+    # (see environment_markers). Whitespace after the last boundary stays at the end of out.
+    boundaries = [("start", None, 0, True)]
+    code_blocks = []    # (content, is_hidden, (start, end)) in document order
+    code_slots = []     # (index into out, index into code_blocks)
+    placeholder_stack = [] # (brace depth, template pieces, indices into out, name) of each open placeholder macro
+    brace_depth = 0     # Nesting depth of braces inside the outermost open placeholder macro
+    code_end_missing = False # Set once no \end{code} is left, so unterminated blocks stay linear
+    # With a trace: { construct: [calls, wall time, CPU time] }, and the construct being timed
+    timings = {} if trace else None
+    timed_construct, timed_wall, timed_cpu = "scan", time.perf_counter(), time.thread_time()
+
+    def charge(next_construct):
+        # Charges the time since the last call to the construct timed so far
+        nonlocal timed_construct, timed_wall, timed_cpu
+        wall, cpu = time.perf_counter(), time.thread_time()
+        record = timings.setdefault(timed_construct, [0, 0.0, 0.0])
+        record[0] += 1
+        record[1] += wall - timed_wall
+        record[2] += cpu - timed_cpu
+        timed_construct, timed_wall, timed_cpu = next_construct, wall, cpu
+
+    def emit_text(text):
+        nonlocal boundaries
+        stripped = text.rstrip()
+        if stripped:
+            out.append(stripped)
+            boundaries = [("text", None, len(out), False)]
+            text = text[len(stripped):]
+        if text:
+            out.append(text)
+
+    def emit_piece(piece):
+        nonlocal boundaries
+        out.append(piece)
+        boundaries = [("text", None, len(out), False)]
+
+    def find_line_start(marker_rank):
+        """
+        Returns (boundary index, index into out) of the position where the wrapper line with the
+        given rank starts, or None if it does not start a line. Wrapper lines with a lower rank
+        were removed before this one's pass and are skipped; everything else is still in place.
+        """
+        i = len(boundaries) - 1
+        while boundaries[i][0] == "removed" and boundaries[i][1] < marker_rank:
+            i -= 1
+        kind, rank, start, ended_with_newline = boundaries[i]
+        if kind == "replaced" and rank < marker_rank:
+            # The admonition marker is already in place: the line start is after its first
+            # trailing newline
+            replaced = out[start - 1]
+            out[start - 1] = replaced[:replaced.index('\n', len(replaced.rstrip())) + 1]
+            return i, start
+        if kind == "start" or (kind != "text" and ended_with_newline):
+            return i, start
+        for j in range(start, len(out)):
+            newline = out[j].find('\n')
+            if newline >= 0:
+                if newline + 1 < len(out[j]):
+                    out.insert(j + 1, out[j][newline + 1:])
+                    out[j] = out[j][:newline + 1]
+                return i, j + 1
+        return None
+
+    pos = 0             # Scan position
+    copied = 0          # Everything before this position has been emitted
+    length = len(content)
+    while pos < length:
+        if timings is not None:
+            charge("scan")
+        pattern = token_pattern if not placeholder_stack else argument_token_pattern
+        match = pattern.search(content, pos)
+        if not match:
+            break
+        token = match.group(0)
+        pos = match.end()
+        if timings is not None:
+            charge(construct_of(token))
+
+        if token == '\\begin{code}':
+            # 1. Code blocks: the content is stored verbatim and never scanned
+            hide_match = code_hide_pattern.match(content, pos)
+            code_start = hide_match.end() if hide_match else pos
+            code_end = -1 if code_end_missing else content.find('\\end{code}', code_start)
+            if code_end < 0:
+                code_end_missing = True
+                pos = match.start() + len('\\begin')
+                continue
+            emit_text(content[copied:match.start()])
+            code_slots.append((len(out), len(code_blocks)))
+            code_blocks.append((content[code_start:code_end], bool(hide_match), (code_start, code_end)))
+            emit_piece(None) # Filled in once all blocks are stored
+            pos = copied = code_end + len('\\end{code}')
+            if trace:
+                trace.count("code_blocks")
+                if hide_match:
+                    trace.count("hidden_code_blocks")
+
+        elif token.startswith('\\begin{') or token.startswith('\\end{'):
+            # 5.-7. Environment wrapper lines
+            kind, name = token[1:-1].split('{')
+            marker_rank, tail_pattern, replacement = environment_markers[(kind, name)]
+            tail_match = tail_pattern.match(content, pos)
+            if tail_match:
+                emit_text(content[copied:match.start()])
+                copied = match.start()
+                line_start = find_line_start(marker_rank)
+            if not tail_match or line_start is None:
+                # Not alone on its line: leave it for Pandoc
+                pos = match.start() + len(kind) + 1
+                continue
+            boundary_index, start = line_start
+            del out[start:]
+            ended_with_newline = content.endswith('\n', pos, tail_match.end())
+            if replacement:
+                out.append(replacement)
+                boundaries = [("replaced", marker_rank, len(out), ended_with_newline)]
+            else:
+                del boundaries[boundary_index + 1:]
+                boundaries.append(("removed", marker_rank, len(out), ended_with_newline))
+            pos = copied = tail_match.end()
+            if trace:
+                if not replacement:
+                    trace.count("wrapper_lines_removed")
+                elif kind == "begin":
+                    trace.count("admonitions")
+
+        elif token == '\\modulenote{':
+            # 2. \modulenote
+            note_match = modulenote_pattern.match(content, match.start())
+            if not note_match:
+                pos = match.start() + len('\\modulenote')
+                continue
+            emit_text(content[copied:match.start()])
+            emit_piece(replace_modulenote_direct(note_match))
+            pos = copied = note_match.end()
+            if trace:
+                trace.count("modulenotes")
+
+        elif token == '{':
+            brace_depth += 1
+
+        elif token == '}':
+            brace_depth -= 1
+            if placeholder_stack[-1][0] != brace_depth:
+                continue
+            # End of an argument of a placeholder macro
+            _, pieces, piece_indices, placeholder_name = placeholder_stack[-1]
+            emit_text(content[copied:match.start()])
+            emit_piece(token)
+            piece_indices.append(len(out) - 1)
+            copied = pos
+            if len(piece_indices) == len(pieces):
+                # 4. All arguments read: put the template pieces in place of the original
+                # \name{ ... }{ ... } delimiters (kept so far in case the macro is incomplete)
+                placeholder_stack.pop()
+                for out_index, piece in zip(piece_indices, pieces):
+                    out[out_index] = piece
+                if trace:
+                    trace.count(f"placeholders/{placeholder_name}")
+            elif content.startswith('{', pos):
+                out[-1] = '}{'
+                brace_depth += 1
+                pos = copied = pos + 1
+            else:
+                placeholder_stack.pop() # Missing argument: leave the macro as it is
+
+        else:
+            # Any other control sequence: look it up in the macro table
+            found = matcher.longest_match(content, match.start() + 1)
+            if trace:
+                word = control_word_pattern.match(content, match.start() + 1)
+                if word and content.startswith('{}', word.end()) and (not found or found[0] != word.end()):
+                    trace.unknown_macro(word.group(0))
+            if not found:
+                continue
+            name_end, (kind, pieces) = found
+            macro_name = content[match.start() + 1:name_end]
+            if kind == "agda_term" and content.startswith('{}', name_end):
+                # 3. Agda term macros
+                emit_text(content[copied:match.start()])
+                emit_piece(expand_agda_term_placeholder(state.macro_data, macro_name, trace))
+                pos = copied = name_end + 2
+                if trace:
+                    trace.count("agda_terms")
+                if manifest:
+                    term_info = agda_term_info(state.macro_data, macro_name)
+                    if term_info:
+                        manifest.add_agda_term(*term_info)
+            elif kind == "placeholder" and len(pieces) == 1 and content.startswith('{}', name_end):
+                emit_text(content[copied:match.start()])
+                emit_piece(pieces[0])
+                pos = copied = name_end + 2
+                if trace:
+                    trace.count(f"placeholders/{macro_name}")
+            elif kind == "placeholder" and len(pieces) > 1 and content.startswith('{', name_end):
+                # 4. Placeholder macros with arguments (e.g. \hldiff): rewritten once the
+                # brace closing their last argument is found
+                emit_text(content[copied:match.start()])
+                emit_piece(content[match.start():name_end + 1])
+                if not placeholder_stack:
+                    brace_depth = 0
+                placeholder_stack.append((brace_depth, pieces, [len(out) - 1], macro_name))
+                brace_depth += 1
+                pos = copied = name_end + 1
+
+    if timings is not None:
+        charge("code_block_store")
+    emit_text(content[copied:])
+
+    # Store the code blocks: hidden blocks first, then visible ones (the order of code_blocks.json)
+    storing_order = [i for i, (_, hidden, _) in enumerate(code_blocks) if hidden] + \
+                    [i for i, (_, hidden, _) in enumerate(code_blocks) if not hidden]
+    placeholder_ids = {}
+    for i in storing_order:
+        placeholder_ids[i] = process_code_block(state, *code_blocks[i])
+    for out_index, block_index in code_slots:
+        out[out_index] = placeholder_ids[block_index]
+    if manifest:
+        # Line numbers of the \begin{code} and \end{code} lines, counted in one pass
+        line, counted = 1, 0
+        for i, (_, hidden, (code_start, code_end)) in enumerate(code_blocks):
+            line += content.count('\n', counted, code_start - 1)
+            first_line = line
+            line += content.count('\n', code_start - 1, code_end)
+            counted = code_end
+            manifest.add_code_block(placeholder_ids[i], hidden, first_line, line)
+
+    if timings is not None:
+        charge(None)
+        for construct, (calls, wall_s, cpu_s) in timings.items():
+            trace.add_time(f"preprocess/{construct}", wall_s, cpu_s, calls)
+    return ''.join(out)
+
+# --- Streaming ---
+def lagda_chunks(lines, macro_data, chunk_size=stream_chunk_size):
+    """
+    Groups the lines of a .lagda file into chunks of at least chunk_size characters (except the
+    last one) that preprocess_lagda can process one at a time with the same result as the whole.
+    The lines are followed the way preprocess_lagda scans them, and a chunk only ends before a
+    line where the scan carries nothing over:
+      - outside every code block;
+      - outside the arguments of every placeholder macro (e.g. \hldiff{...}) and \modulenote,
+        the only places where the scan matches braces (other braces, e.g. in a comment, do not
+        matter);
+      - before a line that does not start with whitespace or with a \begin/\end wrapper, since
+        a wrapper line swallows the whitespace-only lines above it.
+    Where there is no such line (e.g., after an unterminated code block or argument), the chunk
+    grows: a warning is printed once it reaches stream_chunk_warning_factor times chunk_size.
+    Args:
+        lines (iterable): The lines of the file, with their line breaks.
+        macro_data (dict): Macro definitions, as for PreprocessState (for the placeholder macros).
+        chunk_size (int): Size in characters from which a chunk is cut at the next safe line.
+    Yields:
+        str: The chunks, which joined give back the input.
+    """
+    matcher = get_macro_matcher(macro_data)
+    chunk = []
+    size = 0
+    line_number = 0
+    warned = False
+    in_code = False
+    brace_depth = 0     # Brace depth inside the arguments of the outermost open placeholder macro
+    arguments_left = 0  # Arguments of that macro still to come after the current one
+    pending_note = None # The text from a \modulenote that only whitespace may still complete
+    for line in lines:
+        line_number += 1
+        if size >= chunk_size and not in_code and brace_depth == 0 and pending_note is None and line[:1].strip() \
+           and not line.startswith(('\\begin{', '\\end{')):
+            yield ''.join(chunk)
+            chunk, size, warned = [], 0, False
+        elif size >= chunk_size * stream_chunk_warning_factor and not warned:
+            reason = "in a code block" if in_code else "in a macro argument" if brace_depth \
+                else "in a \\modulenote" if pending_note is not None else "no unindented line"
+            print(f"Warning: the chunk from line {line_number - len(chunk)} has grown to {size} characters without "
+                  f"a place to cut it ({reason} at line {line_number}); it is held in memory until there is one.",
+                  file=sys.stderr)
+            warned = True
+        chunk.append(line)
+        size += len(line)
+        text = line
+        if pending_note is not None:
+            # Scanned again from the \modulenote, with one more line
+            text, pending_note = pending_note + line, None
+        pos = 0
+        while True:
+            if in_code:
+                code_end = text.find('\\end{code}', pos)
+                if code_end < 0:
+                    break
+                in_code = False
+                pos = code_end + len('\\end{code}')
+                continue
+            match = (argument_token_pattern if brace_depth else token_pattern).search(text, pos)
+            if not match:
+                break
+            pos = match.end()
+            token = match.group(0)
+            if token == '\\begin{code}':
+                in_code = True
+            elif token == '{':
+                brace_depth += 1
+            elif token == '}':
+                brace_depth -= 1
+                if brace_depth == 0 and arguments_left and text.startswith('{', pos):
+                    # The next argument follows directly
+                    arguments_left -= 1
+                    brace_depth = 1
+                    pos += 1
+                elif brace_depth == 0:
+                    arguments_left = 0
+            elif token == '\\modulenote{':
+                note_match = modulenote_pattern.match(text, match.start())
+                if note_match:
+                    pos = note_match.end()
+                elif modulenote_prefix_pattern.match(text, match.start()):
+                    # May still be completed by the next lines
+                    pending_note = text[match.start():]
+                    break
+                else:
+                    pos = match.start() + len('\\modulenote')
+            elif brace_depth == 0 and control_word_pattern.fullmatch(token, 1):
+                found = matcher.longest_match(text, match.start() + 1)
+                if found and found[1][0] == "placeholder" and len(found[1][1]) > 1 \
+                   and text.startswith('{', found[0]):
+                    brace_depth = 1
+                    arguments_left = len(found[1][1]) - 2
+                    pos = found[0] + 1
+    if chunk:
+        yield ''.join(chunk)
+
+def preprocess_lagda_stream(lines, macro_data, chunk_size=stream_chunk_size):
+    """
+    Preprocesses a .lagda file chunk by chunk (see lagda_chunks), so that only one chunk and its
+    code blocks are held in memory at a time. The processed chunks joined are the output of
+    preprocess_lagda for the whole file.
+    Args:
+        lines (iterable): The lines of the file, with their line breaks (e.g., the open file).
+        macro_data (dict): Macro definitions, as for PreprocessState.
+        chunk_size (int): See lagda_chunks.
+    Yields:
+        tuple: (chunk, processed LaTeX of the chunk, PreprocessState of the chunk). The code
+               block spans of the state are offsets into the chunk.
+    """
+    for chunk in lagda_chunks(lines, macro_data, chunk_size):
+        state = PreprocessState(macro_data)
+        yield chunk, preprocess_lagda(chunk, state), state
+
+class CodeBlockJsonStream:
+    """
+    Writes the code_blocks.json dictionary to a file entry by entry, as the code blocks are
+    found, in the format of json.dump(..., indent=2). Only the placeholder IDs written so far are
+    kept, to skip the identical blocks found again.
+    """
+
+    def __init__(self, f_out):
+        self.f_out = f_out
+        self.written = set()
+
+    def add(self, code_blocks_data):
+        for placeholder_id, data in code_blocks_data.items():
+            if placeholder_id in self.written:
+                continue
+            self.f_out.write(',\n' if self.written else '{\n')
+            self.f_out.write(f'  {json.dumps(placeholder_id)}: ' + json.dumps(data, indent=2).replace('\n', '\n  '))
+            self.written.add(placeholder_id)
+
+    def close(self):
+        self.f_out.write('\n}' if self.written else '{}')
+
+def preprocess_file_stream(input_path, macro_data, code_blocks_path, out, chunk_size=stream_chunk_size):
+    """
+    Preprocesses a .lagda file with preprocess_lagda_stream, writing the processed LaTeX to out
+    and the code blocks to code_blocks_path as each chunk is done: a JSON file is written entry
+    by entry (the blocks of each chunk hidden first), an index (.idx) keeps only the offsets.
+    Returns:
+        tuple: (number of code blocks, True if the code blocks file was written).
+    """
+    write_index = code_blocks_path.endswith(".idx")
+    # For an index, line endings are kept so that offsets into the chunks are offsets into the file
+    with open(input_path, 'r', encoding='utf-8', newline='' if write_index else None) as f_lagda:
+        chunks = preprocess_lagda_stream(f_lagda, macro_data, chunk_size)
+        if write_index:
+            spans = {}
+            chunk_offset = 0 # Byte offset of the current chunk in the file
+            for chunk, processed_chunk, state in chunks:
+                out.write(processed_chunk)
+                for placeholder_id, (start, end, hidden) in code_block_index.byte_spans(chunk, state.code_block_spans).items():
+                    spans[placeholder_id] = (chunk_offset + start, chunk_offset + end, hidden)
+                chunk_offset += len(chunk.encode('utf-8'))
+            return len(spans), code_block_index.write_index(code_blocks_path, input_path, spans)
+        with ChangedFileWriter(code_blocks_path) as f_code:
+            code_block_stream = CodeBlockJsonStream(f_code)
+            for _, processed_chunk, state in chunks:
+                out.write(processed_chunk)
+                code_block_stream.add(state.code_blocks_data)
+            code_block_stream.close()
+        return len(code_block_stream.written), f_code.changed
 
 # --- Script Entry Point ---
 if __name__ == "__main__":
-    # Expect input .lagda file, input macro JSON, output code blocks JSON path
-    if len(sys.argv) != 4:
-        print(f"Usage: python {sys.argv[0]} <input.lagda> <macros.json> <output_code_blocks.json>")
+    # Expect input .lagda file, input macro JSON, output code blocks JSON (or .idx) path
+    stream = "--stream" in sys.argv[1:]
+    args = [arg for arg in sys.argv[1:] if arg != "--stream"]
+    if len(args) != 3:
+        print(f"Usage: python {sys.argv[0]} [--stream] <input.lagda> <macros.json> <output_code_blocks.json|.idx>")
         sys.exit(1)
 
-    input_lagda_file = sys.argv[1]
-    input_json_file = sys.argv[2]
-    output_code_blocks_file = sys.argv[3] # File to save code blocks
-
-    # Reset global state in case script is imported/run multiple times in one process
-    code_blocks_data = {}
-    code_block_counter = 0
-    macro_data = {}
+    input_lagda_file = args[0]
+    input_json_file = args[1]
+    output_code_blocks_file = args[2] # File to save code blocks
+    write_index = output_code_blocks_file.endswith(".idx")
 
     try:
         # Load macro definitions from JSON file provided as argument
@@ -199,26 +689,43 @@ if __name__ == "__main__":
             macro_data = json.load(f_json)
         print(f"Loaded {len(macro_data.get('agda_terms', {}))} Agda term macros.", file=sys.stderr)
 
-        # Read input lagda file content
-        print(f"Reading input file {input_lagda_file}", file=sys.stderr)
-        with open(input_lagda_file, 'r', encoding='utf-8') as f_lagda:
-            input_content = f_lagda.read()
-
-        # Process the content using the main function
-        print(f"Processing content...", file=sys.stderr)
-        processed_content = preprocess_lagda(input_content) # This populates global code_blocks_data
+        if stream:
+            # Read, process and write out the input chunk by chunk
+            print(f"Processing {input_lagda_file} in chunks...", file=sys.stderr)
+            count, changed = preprocess_file_stream(input_lagda_file, macro_data, output_code_blocks_file, sys.stdout)
+            print(f"Processed LaTeX content written to stdout.", file=sys.stderr)
+            print(f"{count} code blocks {'indexed' if write_index else 'saved'}"
+                  f"{'' if changed else ' (file unchanged)'}.", file=sys.stderr)
+        else:
+            # Read input lagda file content
+            print(f"Reading input file {input_lagda_file}", file=sys.stderr)
+            # For an index, line endings are kept so that offsets into the content are offsets into the file
+            with open(input_lagda_file, 'r', encoding='utf-8', newline='' if write_index else None) as f_lagda:
+                input_content = f_lagda.read()
 
-        # Output the processed LaTeX (with placeholders) to standard output
-        sys.stdout.write(processed_content)
-        print(f"Processed LaTeX content written to stdout.", file=sys.stderr)
+            # Process the content using the main function
+            print(f"Processing content...", file=sys.stderr)
+            state = PreprocessState(macro_data)
+            processed_content = preprocess_lagda(input_content, state) # This populates state.code_blocks_data
 
+            # Output the processed LaTeX (with placeholders) to standard output
+            sys.stdout.write(processed_content)
+            print(f"Processed LaTeX content written to stdout.", file=sys.stderr)
 
-        # Save the captured code blocks dictionary to the specified JSON file
-        print(f"Saving code blocks data to {output_code_blocks_file}", file=sys.stderr)
-        with open(output_code_blocks_file, 'w', encoding='utf-8') as f_code:
-            # Use indent for readability
-            json.dump(code_blocks_data, f_code, indent=2)
-        print(f"{len(code_blocks_data)} code blocks saved.", file=sys.stderr)
+            if write_index:
+                # Save only the byte offsets of the code blocks in the input file
+                print(f"Saving code block index to {output_code_blocks_file}", file=sys.stderr)
+                spans = code_block_index.byte_spans(input_content, state.code_block_spans)
+                changed = code_block_index.write_index(output_code_blocks_file, input_lagda_file, spans)
+                print(f"{len(spans)} code blocks indexed{'' if changed else ' (index unchanged)'}.", file=sys.stderr)
+            else:
+                # Save the captured code blocks dictionary to the specified JSON file
+                print(f"Saving code blocks data to {output_code_blocks_file}", file=sys.stderr)
+                with ChangedFileWriter(output_code_blocks_file) as f_code:
+                    # Use indent for readability
+                    json.dump(state.code_blocks_data, f_code, indent=2)
+                print(f"{len(state.code_blocks_data)} code blocks saved{'' if f_code.changed else ' (file unchanged)'}.",
+                      file=sys.stderr)
 
     except FileNotFoundError as e:
         print(f"Error: Input file not found: {e.filename}", file=sys.stderr)
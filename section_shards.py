@@ -0,0 +1,74 @@
+# section_shards.py
+# Purpose: Converts one large preprocessed document with several Pandoc processes at once,
+#          so that a big module (or a concatenated build) is not limited to a single core.
+# Actions:
+# 1. Splits the preprocessed LaTeX (the output of preprocess_lagda) into the segments of
+#    segment_cache.split_segments (paragraphs outside every environment and brace group).
+# 2. Groups consecutive segments into shards of similar size. A shard may only start with a
+#    \section or \subsection, and never between an @@ADMONITION_START@@ marker and its
+#    @@ADMONITION_END@@. Code blocks are single placeholders by then, so a split cannot fall
+#    inside one.
+# 3. Runs every shard through Pandoc + filter concurrently (one thread per shard waiting on
+#    its own Pandoc process) and joins the results in order, one blank line apart, as Pandoc
+#    separates blocks.
+# Like segment_cache.py, it converts the document at once whenever the joined result could
+# differ from a single run (state carried across paragraphs, adjacent lists at a shard border).
+
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from segment_cache import join_segments, needs_full_conversion, split_segments
+
+shard_start_pattern = re.compile(r'\s*\\(?:section|subsection)\*?\{')
+admonition_start_marker = "@@ADMONITION_START|"
+admonition_end_marker = "@@ADMONITION_END@@"
+
+def split_shards(latex_content, shard_count):
+    """
+    Splits preprocessed LaTeX into at most shard_count shards of similar size, cutting only
+    before a \\section or \\subsection that is outside every admonition.
+    Returns:
+        list[str]: The shards, each made of whole segments separated by blank lines (a single
+                   shard if there is no valid boundary).
+    """
+    segments = split_segments(latex_content)
+    target = sum(len(segment) for segment in segments) / max(shard_count, 1)
+    shards = []
+    current = []
+    current_size = 0
+    admonition_depth = 0
+    for segment in segments:
+        if current and admonition_depth == 0 and current_size >= target and len(shards) < shard_count - 1 \
+           and shard_start_pattern.match(segment):
+            shards.append(current)
+            current, current_size = [], 0
+        current.append(segment)
+        current_size += len(segment)
+        admonition_depth += segment.count(admonition_start_marker) - segment.count(admonition_end_marker)
+    if current:
+        shards.append(current)
+    return ['\n\n'.join(shard) for shard in shards]
+
+def convert_sharded(latex_content, shard_count, run_pandoc):
+    """
+    Converts preprocessed LaTeX to Markdown like run_pandoc, running up to shard_count
+    Pandoc processes concurrently. The result is the same as run_pandoc(latex_content).
+    Args:
+        latex_content (str): Output of preprocess_lagda.
+        shard_count (int): Maximum number of shards (and concurrent Pandoc processes).
+        run_pandoc (callable): Converts LaTeX content to Markdown; must be thread-safe.
+    Returns:
+        tuple: (Markdown, number of shards converted).
+    """
+    if shard_count < 2 or needs_full_conversion(latex_content):
+        return run_pandoc(latex_content), 1
+    shards = split_shards(latex_content, shard_count)
+    if len(shards) < 2:
+        return run_pandoc(latex_content), 1
+
+    with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+        converted = list(pool.map(run_pandoc, shards))
+    markdown = join_segments([piece.rstrip('\n') for piece in converted])
+    if markdown is None:
+        return run_pandoc(latex_content), 1
+    return markdown, len(shards)
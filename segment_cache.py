@@ -0,0 +1,161 @@
+# segment_cache.py
+# Purpose: Paragraph-level memoization of the Pandoc step, so that an edit to one paragraph
+#          only sends that paragraph to Pandoc.
+# Actions:
+# 1. Splits the preprocessed LaTeX (the output of preprocess_lagda) into segments at the
+#    paragraph breaks (blank lines) that no environment or brace group spans. Code block
+#    placeholders and admonition markers that stand in their own paragraph therefore become
+#    segments of their own.
+# 2. Looks every segment up in a persistent segment cache (a build_cache.BuildCache).
+# 3. Sends all segments that miss to Pandoc + agda-filter.lua in one run, separated by
+#    @@SEGMENT_BREAK@@ paragraphs, and stores the Markdown of each one in the cache.
+# 4. Stitches the Markdown of the segments back together, one blank line apart, exactly as
+#    Pandoc separates blocks in a full-document conversion.
+# Falls back to converting the whole document at once when the result could differ:
+# - the document uses state that Pandoc carries across paragraphs (macro definitions,
+#   footnotes, \ref, conditionals, \part or \chapter, or section titles that would get the
+#   same identifier);
+# - two neighbouring segments both produce lists (Pandoc separates those with a comment);
+# - the segment breaks do not all come back from Pandoc.
+
+import re
+
+segment_break = "@@SEGMENT_BREAK@@"
+
+# Constructs whose meaning depends on other paragraphs of the document (with a \part or
+# \chapter anywhere, Pandoc shifts the level of every heading of the document)
+global_state_pattern = re.compile(r'\\(?:part|chapter|newcommand|renewcommand|providecommand|def|gdef|edef|xdef|let'
+                                  r'|newenvironment|renewenvironment|DeclareMathOperator|makeatletter'
+                                  r'|footnote|ref|eqref|cref|Cref|autoref|pageref|if[A-Za-z]*)(?![A-Za-z])')
+section_pattern = re.compile(r'\\(?:part|chapter|section|subsection|subsubsection|paragraph)\*?(?:\[[^\]]*\])?\{')
+title_token_pattern = re.compile(r'\\.|[{}]', re.DOTALL)
+agda_term_marker_pattern = re.compile(r'@@AgdaTerm@@basename=(.*?)@@class=.*?@@')
+control_word_pattern = re.compile(r'\\[A-Za-z@]+\*?')
+environment_pattern = re.compile(r'\\(begin|end)\{')
+comment_pattern = re.compile(r'(?<!\\)%.*')
+escaped_brace_pattern = re.compile(r'\\[\\{}]')
+list_item_pattern = re.compile(r'(?:[-*+]|\d+[.)])[ \t]')
+segment_break_pattern = re.compile(r'\n*^' + re.escape(segment_break) + r'$\n*', re.MULTILINE)
+
+def split_segments(content):
+    """
+    Splits LaTeX content at the blank lines that are outside every environment and brace group.
+    Args:
+        content (str): The preprocessed LaTeX content.
+    Returns:
+        list[str]: The segments, without the blank lines between them (whitespace-only
+                   segments are dropped).
+    """
+    segments = []
+    current = []
+    depth = 0 # Open environments plus open braces
+    for line in content.splitlines(keepends=True):
+        if depth == 0 and not line.strip():
+            if current:
+                segments.append(''.join(current))
+                current = []
+            continue
+        current.append(line)
+        code = escaped_brace_pattern.sub('', comment_pattern.sub('', line))
+        for kind in environment_pattern.findall(code):
+            depth += 1 if kind == "begin" else -1
+        depth += code.count('{') - code.count('}')
+        depth = max(depth, 0) # A stray closing brace must not block every later break
+    if current:
+        segments.append(''.join(current))
+    return [segment for segment in segments if segment.strip()]
+
+def section_titles(content):
+    """
+    Returns the titles of the sectioning commands in content, each up to its matching brace
+    (titles hold braces as soon as they contain a macro, e.g. an Agda term marker).
+    """
+    titles = []
+    for match in section_pattern.finditer(content):
+        depth = 1
+        for token in title_token_pattern.finditer(content, match.end()):
+            if token.group(0) == '{':
+                depth += 1
+            elif token.group(0) == '}':
+                depth -= 1
+                if depth == 0:
+                    titles.append(content[match.end():token.start()])
+                    break
+    return titles
+
+def identifier_keys(title):
+    """
+    Returns two approximations of the identifier Pandoc derives from a section title (its
+    letters and digits, from the first letter on, or "section" if there are none): one without
+    the macro names and one with them, as a macro may or may not contribute text. Agda term
+    markers count as their basename.
+    """
+    title = agda_term_marker_pattern.sub(r' \1 ', title)
+    keys = []
+    for text in (control_word_pattern.sub(' ', title), title):
+        key = re.sub(r'^[^a-z]+', '', re.sub(r'[^0-9a-z]+', '', text.lower()))
+        keys.append(key or "section")
+    return keys
+
+def needs_full_conversion(content):
+    """
+    Returns True if converting content segment by segment could give a different result
+    than converting it at once because of state Pandoc carries across paragraphs.
+    """
+    if segment_break in content or global_state_pattern.search(comment_pattern.sub('', content)):
+        return True
+    # Pandoc makes identifiers of sections with the same title unique by numbering them
+    keys = [identifier_keys(title) for title in section_titles(content)]
+    return any(len({key[i] for key in keys}) != len(keys) for i in range(2))
+
+def last_top_level_line(markdown):
+    for line in reversed(markdown.splitlines()):
+        if line and not line[0].isspace():
+            return line
+    return ""
+
+def join_segments(converted):
+    """
+    Joins the Markdown of consecutive segments the way Pandoc separates blocks.
+    Returns:
+        str: The joined Markdown, or None if two neighbouring segments both produce lists
+             (or no segment produces anything).
+    """
+    pieces = [piece for piece in converted if piece]
+    for previous, following in zip(pieces, pieces[1:]):
+        if list_item_pattern.match(last_top_level_line(previous)) and list_item_pattern.match(following):
+            return None
+    return '\n\n'.join(pieces) + '\n' if pieces else None
+
+def convert_segmented(latex_content, cache, run_pandoc):
+    """
+    Converts preprocessed LaTeX to Markdown like run_pandoc, reusing the Markdown of the
+    segments that are already in the cache.
+    Args:
+        latex_content (str): Output of preprocess_lagda.
+        cache (build_cache.BuildCache): The segment cache.
+        run_pandoc (callable): Converts LaTeX content to Markdown (Pandoc + agda-filter.lua).
+    Returns:
+        tuple: (Markdown, (segment cache hits, segment cache misses, full conversions)).
+    """
+    segments = split_segments(latex_content)
+    if needs_full_conversion(latex_content) or not segments:
+        return run_pandoc(latex_content), (0, 0, 1)
+
+    keys = [cache.key_for(segment.encode('utf-8')) for segment in segments]
+    converted = [cache.get(key) for key in keys]
+    missing = [i for i, markdown in enumerate(converted) if markdown is None]
+    if missing:
+        batch = run_pandoc(f"\n\n{segment_break}\n\n".join(segments[i] for i in missing))
+        pieces = segment_break_pattern.split(batch.strip('\n'))
+        if len(pieces) != len(missing):
+            return run_pandoc(latex_content), (0, 0, 1)
+        for i, piece in zip(missing, pieces):
+            converted[i] = piece + '\n' if piece else ""
+
+    markdown = join_segments([piece.rstrip('\n') for piece in converted])
+    if markdown is None:
+        return run_pandoc(latex_content), (0, 0, 1)
+    for i in missing:
+        cache.put(keys[i], converted[i])
+    return markdown, (len(segments) - len(missing), len(missing), 0)
@@ -0,0 +1,114 @@
+# synthetic_lagda.py
+# Purpose: Generates synthetic LaTeX-based literate Agda documents of a controlled size and
+#          shape, for benchmarking the pipeline (see bench_pipeline.py).
+# Actions:
+# 1. Takes its material from seed files: the code blocks and prose words of a real module
+#    (Transaction.lagda) and the Agda term macros of macros.sty.
+# 2. Assembles a document with a given number of lines and code blocks, a given fraction of
+#    prose words replaced by Agda term macros, a given number of \hldiff{...} highlights and
+#    Conway/NoConway/AgdaMultiCode environments nested to a given depth.
+# The output depends only on the seeds and the parameters (including the random seed).
+#
+# USAGE:
+#   python synthetic_lagda.py 10000 100 > Synthetic.lagda      (10000 lines, 100 code blocks)
+
+import json
+import os
+import random
+import re
+import sys
+
+from generate_macros_json import generate_macros_json
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+default_seed_lagda = os.path.join(script_dir, "Transaction.lagda")
+default_seed_sty = os.path.join(script_dir, "macros.sty")
+# Environments used for nesting, cycled through from the outside in
+wrapper_environments = ["Conway", "NoConway", "AgdaMultiCode"]
+words_per_line = 12
+
+code_block_pattern = re.compile(r'\\begin\{code\}(\[hide\])?[^\n]*\n(.*?)\\end\{code\}', re.DOTALL)
+word_pattern = re.compile(r"(?<!\\)\b[A-Za-z][a-z]+\b")
+
+def load_seeds(lagda_file=default_seed_lagda, sty_file=default_seed_sty):
+    """
+    Reads the material for generate_document from the seed files.
+    Returns:
+        tuple: (code blocks as a list of (lines, hidden), prose words, Agda term macro names).
+    """
+    with open(lagda_file, 'r', encoding='utf-8') as f_lagda:
+        lagda = f_lagda.read()
+    with open(sty_file, 'r', encoding='utf-8') as f_sty:
+        macro_names = sorted(json.loads(generate_macros_json(f_sty.read()))["agda_terms"])
+    code_blocks = [(code.splitlines(), bool(hide)) for hide, code in code_block_pattern.findall(lagda)]
+    prose = code_block_pattern.sub('', lagda)
+    prose = re.sub(r'\\[A-Za-z@]+(\{[^{}]*\})?', ' ', prose) # Drop the macros themselves
+    words = sorted(set(word_pattern.findall(prose)))
+    return code_blocks, words, macro_names
+
+def generate_document(lines, code_blocks, macro_density=0.05, nesting=1, hldiffs=0, seed=0, seeds=None):
+    """
+    Generates a synthetic .lagda document.
+    Args:
+        lines (int): Approximate number of lines of the document (each code block takes at
+            least 6 lines plus 2 per nesting level, so small documents with many blocks are longer).
+        code_blocks (int): Number of code blocks (one in three is hidden, as in the seed).
+        macro_density (float): Fraction of the prose words that are Agda term macros (0 to 1).
+        nesting (int): Depth of the Conway/NoConway/AgdaMultiCode environments around each
+            section (0 for none).
+        hldiffs (int): Number of \\hldiff{...} highlights in the prose.
+        seed (int): Random seed.
+        seeds (tuple): Result of load_seeds (loaded from the default seed files if None).
+    Returns:
+        str: The document.
+    """
+    rng = random.Random(seed)
+    seed_blocks, words, macro_names = seeds or load_seeds()
+    code_blocks = max(code_blocks, 1)
+    # Each section: wrappers, a paragraph of prose, a code block (with its two delimiters) and a
+    # blank line. About 60% of the free lines are code, but no more than in an average seed block.
+    available_lines = lines // code_blocks - (2 * nesting + 3)
+    average_seed_lines = sum(len(block) for block, _ in seed_blocks) / len(seed_blocks)
+    code_lines = max(2, min(round(average_seed_lines), available_lines * 6 // 10))
+    prose_lines = max(1, available_lines - code_lines)
+    hldiff_lines = set(rng.sample(range(code_blocks * prose_lines), min(hldiffs, code_blocks * prose_lines)))
+
+    out = ["\\section{Synthetic}", "\\modulenote{\\LedgerModule{Synthetic}}", ""]
+    prose_line_number = 0
+    for section in range(code_blocks):
+        for level in range(nesting):
+            out.append(f"\\begin{{{wrapper_environments[level % len(wrapper_environments)]}}}")
+        for _ in range(prose_lines):
+            line_words = []
+            for _ in range(words_per_line):
+                if rng.random() < macro_density:
+                    line_words.append(f"\\{rng.choice(macro_names)}{{}}")
+                else:
+                    line_words.append(rng.choice(words))
+            if prose_line_number in hldiff_lines:
+                position = rng.randrange(len(line_words))
+                line_words[position] = f"\\hldiff{{{line_words[position]}}}"
+            out.append(' '.join(line_words))
+            prose_line_number += 1
+        # The first line makes every block unique, as blocks with the same content share a placeholder
+        block, _ = rng.choice(seed_blocks)
+        start = rng.randrange(max(1, len(block) - code_lines + 2))
+        code = [f"  -- block {section}"] + block[start:start + code_lines - 1]
+        code += ["  -- filler"] * (code_lines - len(code))
+        out.append("\\begin{code}[hide]" if section % 3 == 0 else "\\begin{code}")
+        out.extend(code)
+        out.append("\\end{code}")
+        for level in reversed(range(nesting)):
+            out.append(f"\\end{{{wrapper_environments[level % len(wrapper_environments)]}}}")
+        out.append("")
+    return '\n'.join(out) + '\n'
+
+# --- Script Entry Point ---
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4, 5, 6):
+        print(f"Usage: python {sys.argv[0]} <lines> <code_blocks> [macro_density] [nesting] [hldiffs]")
+        sys.exit(1)
+    arguments = [int(sys.argv[1]), int(sys.argv[2])]
+    arguments += [float(sys.argv[3])] if len(sys.argv) > 3 else []
+    arguments += [int(value) for value in sys.argv[4:]]
+    sys.stdout.write(generate_document(*arguments))
@@ -0,0 +1,197 @@
+# watch_tree.py
+# Purpose: Keeps the .lagda.md files of a source tree up to date while the .lagda files are
+#          being edited (e.g. next to `mkdocs serve`), reconverting each saved file in memory.
+# Actions:
+# 1. Builds the macro table from macros.sty once and keeps it, with the compiled macro matcher
+#    and scanner patterns, in this long-running process. A warm-up conversion at startup also
+#    loads Pandoc and the filter from disk before the first save. With --pandoc-server, Pandoc
+#    itself stays running too (see pandoc_server.py).
+# 2. Polls the modification times of the .lagda files below the source directory and of
+#    macros.sty (standard library only: no inotify bindings or external services).
+# 3. Waits until nothing has changed for --debounce milliseconds, so that a burst of saves
+#    (or an editor writing a file in several steps) leads to one reconversion per file.
+# 4. Reconverts the changed files with pipeline.convert and writes <name>.lagda.md next to
+#    each. A change to macros.sty rebuilds the macro table and reconverts the files that
+#    reference a macro that was added, removed or changed (see macro_index.py).
+# 5. Prints, for each reconversion, the conversion time and the latency from the save (the
+#    modification time of the .lagda file) to the written .lagda.md.
+#
+# USAGE:
+#   python watch_tree.py src/Ledger macros.sty
+#   python watch_tree.py src/Ledger macros.sty --interval 20 --debounce 30 --filter-engine python
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import output_writer
+import pandoc_server
+import pipeline
+from convert_tree import find_lagda_files
+from generate_macros_json import diff_macro_tables, generate_macros_json
+from macro_index import MacroIndex, referenced_macros
+
+# --- Configuration ---
+default_interval_ms = 25
+default_debounce_ms = 25
+warm_up_document = "\\section{Warm-up}\n\\begin{Conway}\nText.\n\\end{Conway}\n\\begin{code}\nx = x\n\\end{code}\n"
+
+def load_macro_data(sty_file):
+    """
+    Builds the macro table (the content of preprocess_macros.json) from macros.sty.
+    """
+    with open(sty_file, 'r', encoding='utf-8') as f_sty:
+        return json.loads(generate_macros_json(f_sty.read()))
+
+def snapshot(root, sty_file):
+    """
+    Returns { path: (modification time in ns, size) } for the .lagda files below root and
+    for sty_file. Files that disappear while being listed are left out.
+    """
+    stamps = {}
+    for path in find_lagda_files(root) + [sty_file]:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        stamps[path] = (stat.st_mtime_ns, stat.st_size)
+    return stamps
+
+def changed_paths(before, after):
+    """
+    Returns the paths that are new in after or whose stamp differs from before.
+    Deleted files are ignored (their .lagda.md is left in place).
+    """
+    return {path for path, stamp in after.items() if before.get(path) != stamp}
+
+def index_file(index, input_lagda_file):
+    """
+    Records the macros referenced by a file in the macro index.
+    """
+    with open(input_lagda_file, 'r', encoding='utf-8') as f_lagda:
+        index.update(input_lagda_file, referenced_macros(f_lagda.read()))
+
+def reconvert(input_lagda_file, macro_data, filter_engine, index, saved_at=None, server=None):
+    """
+    Converts one file, writes <input>.md next to it (if its content changes) and updates its
+    macro index entry.
+    Args:
+        saved_at (float): Time (as from time.time()) of the save that made the conversion
+            necessary; defaults to the modification time of the file.
+        server (pandoc_server.PandocClient): Optional Pandoc server.
+    Returns:
+        tuple: (conversion time in seconds, seconds since the save, True if the output was written).
+    Raises:
+        RuntimeError: If Pandoc fails.
+    """
+    start = time.perf_counter()
+    if saved_at is None:
+        saved_at = os.stat(input_lagda_file).st_mtime_ns / 1e9
+    with open(input_lagda_file, 'r', encoding='utf-8') as f_lagda:
+        source = f_lagda.read()
+    index.update(input_lagda_file, referenced_macros(source))
+    final_content = pipeline.convert(source, macro_data, filter_engine, pandoc_server=server)
+    changed = output_writer.write_if_changed(input_lagda_file + ".md", final_content)
+    return time.perf_counter() - start, time.time() - saved_at, changed
+
+def watch(root, sty_file, interval, debounce, filter_engine, server=None):
+    """
+    Watches root and sty_file until interrupted, reconverting the files that change.
+    Args:
+        root (str): Directory searched recursively for .lagda files.
+        sty_file (str): The macros.sty the macro table is built from.
+        interval (float): Seconds between two polls.
+        debounce (float): Seconds without changes to wait for before reconverting.
+        filter_engine (str): "lua" or "python" (see pipeline.convert).
+        server (pandoc_server.PandocClient): Optional Pandoc server.
+    """
+    macro_data = load_macro_data(sty_file)
+    print(f"Loaded {len(macro_data.get('agda_terms', {}))} Agda term macros from {sty_file}.", file=sys.stderr)
+    pipeline.convert(warm_up_document, macro_data, filter_engine, pandoc_server=server)
+
+    known = snapshot(root, sty_file)
+    index = MacroIndex()
+    for input_lagda_file in known:
+        if input_lagda_file != sty_file:
+            try:
+                index_file(index, input_lagda_file)
+            except (OSError, UnicodeDecodeError):
+                pass # Reported when the file is converted
+    print(f"Watching {len(known) - (sty_file in known)} .lagda files below {root} (Ctrl-C to stop)...",
+          file=sys.stderr)
+    pending = set()
+    last_change = 0.0
+    while True:
+        time.sleep(interval)
+        current = snapshot(root, sty_file)
+        changed = changed_paths(known, current)
+        known = current
+        if changed:
+            # Wait for the burst of saves to end before converting
+            pending |= changed
+            last_change = time.monotonic()
+            continue
+        if not pending or time.monotonic() - last_change < debounce:
+            continue
+
+        targets = pending - {sty_file}
+        saved_at = None
+        if sty_file in pending:
+            try:
+                new_macro_data = load_macro_data(sty_file)
+                changes = diff_macro_tables(macro_data, new_macro_data)
+                macro_data = new_macro_data
+                affected = index.modules_using(changes["added"] + changes["removed"] + changes["changed"])
+                print(f"Reloaded {sty_file}: {len(changes['added'])} macros added, {len(changes['removed'])} "
+                      f"removed, {len(changes['changed'])} changed; reconverting {len(affected)} files.")
+                targets |= affected
+                saved_at = known[sty_file][0] / 1e9
+            except (OSError, UnicodeDecodeError) as e:
+                print(f"  FAILED  {sty_file}: {e} (keeping the previous macro table)")
+        pending.clear()
+
+        for input_lagda_file in sorted(targets):
+            try:
+                elapsed, latency, changed = reconvert(input_lagda_file, macro_data, filter_engine, index, saved_at,
+                                                      server)
+                print(f"  {elapsed * 1000:>7.1f} ms  {input_lagda_file} ({latency * 1000:.0f} ms after save"
+                      f"{'' if changed else ', output unchanged'})", flush=True)
+            except FileNotFoundError:
+                index.remove(input_lagda_file) # Deleted since the change was seen
+            except Exception as e:
+                print(f"  FAILED  {input_lagda_file}: {e}", flush=True)
+
+# --- Script Entry Point ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconvert .lagda files to .lagda.md as they are saved.")
+    parser.add_argument("source_dir", help="directory to watch recursively for .lagda files")
+    parser.add_argument("macros_sty", help="LaTeX macro definitions (reloaded when they change)")
+    parser.add_argument("--interval", type=int, default=default_interval_ms,
+                        help=f"milliseconds between two polls (default: {default_interval_ms})")
+    parser.add_argument("--debounce", type=int, default=default_debounce_ms,
+                        help=f"milliseconds without changes before reconverting (default: {default_debounce_ms})")
+    parser.add_argument("--filter-engine", choices=pipeline.filter_engines, default="lua",
+                        help="agda-filter.lua, or agda_filter.py on Pandoc's JSON AST (default: lua)")
+    parser.add_argument("--pandoc-server", action="store_true",
+                        help="keep a local pandoc server running instead of starting pandoc per conversion")
+    args = parser.parse_args()
+
+    server_process, server = None, None
+    if args.pandoc_server:
+        try:
+            server_process, server = pandoc_server.start_server()
+        except RuntimeError as e:
+            print(f"Warning: {e}; running pandoc per conversion.", file=sys.stderr)
+    try:
+        watch(args.source_dir, args.macros_sty, args.interval / 1000, args.debounce / 1000, args.filter_engine,
+              server)
+    except FileNotFoundError as e:
+        print(f"Error: Input file not found: {e.filename}", file=sys.stderr)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("Stopped.", file=sys.stderr)
+    finally:
+        if server_process:
+            server_process.terminate()